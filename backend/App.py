@@ -3,22 +3,31 @@
 # 概要：クライアントからのリクエストをWebAPIで受信し、対応する処理を実施する。
 ###############################################################################
 from dotenv import load_dotenv
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from sqlalchemy import create_engine
+from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
-from typing import List, Optional, Union
+from typing import Any, Dict, List, Optional, Union
 
+from functools import lru_cache
+import hashlib
 import json
+import math
 import numpy as np
 import os
 import pandas as pd
 from sklearn.preprocessing import LabelEncoder
 
-from Define import FETCH_REQ, MODEL, INPUT_DATA, GetProblem, GetParamDict, GetPreprocDict
-from Learning import ExecLearning_Nn, ExecLearning_Trdt
-from Optimize import Optimize
+from Cache import LruCache, DiskCache, GetCacheMetrics
+from Database import InitEngine, DisposeEngine, Connect, GetPoolMetrics, GetTableVersion
+from Define import FETCH_REQ, RES_FORMAT, JOB_STATUS, MODEL, INPUT_DATA, INPUT_DATA_KEY, GetProblem, GetParamDict, GetPreprocDict, GetPreprocDictVersion, ReserveLearningCpus
+from Encode import EncodeColumnar, EncodeArrow, ArrowAvailable
+from Job import JobManager
+from Learning import ExecLearning_Nn, ExecLearning_Trdt, LoadPredictModel, PredictModel, splitCache, neighborCache, NN_ENGINE
+from Model import GetModelKey, ModelExists
+from Optimize import Optimize, InitRay, ShutdownRay
 
 # FastAPI設定
 load_dotenv("./envVal.env")
@@ -27,15 +36,82 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=[os.getenv("CLIENT_URL")],
     allow_credentials=True,
-    allow_methods=["POST"],
+    allow_methods=["GET", "POST"],
     allow_headers=["*"])
 
+# 入力データのキャッシュ (キー: テーブル名)
+# DATASET_CACHE_MB           : メモリ上限(MB) (既定値: 256)
+# DATASET_CACHE_TTL          : 有効期限(秒) (既定値: 600)
+# DATASET_CACHE_VERSION_CHECK: 取得時にテーブルの更新有無を確認するか (既定値: True)
+datasetCache = LruCache("dataset", int(os.getenv("DATASET_CACHE_MB", "256")) * 1024 * 1024,
+                        float(os.getenv("DATASET_CACHE_TTL", "600")))
+datasetVersionCheck = (os.getenv("DATASET_CACHE_VERSION_CHECK", "True") == "True")
+
+# 前処理データのキャッシュ (キー: テーブル名、ターゲット、前処理辞書のバージョン)
+# PREPROC_CACHE_MB : メモリ上限(MB) (既定値: 256)
+# PREPROC_CACHE_TTL: 有効期限(秒) (既定値: 600)
+preprocCache = LruCache("preproc", int(os.getenv("PREPROC_CACHE_MB", "256")) * 1024 * 1024,
+                        float(os.getenv("PREPROC_CACHE_TTL", "600")))
+# 基本前処理の実行方式 (True: コンパイル済みプランで一括処理、False: 前処理辞書を逐次処理)
+preprocCompiled = (os.getenv("PREPROC_COMPILED", "False") == "True")
+
+# 学習結果のキャッシュ (キー: テーブル名、学習条件のハッシュ値)
+# 同一のデータ・パラメータの学習は乱数シードが固定のため同一の結果となり、再学習せずに結果を返す
+# RESULT_CACHE_DIR: 保存先ディレクトリ (既定値: ./cache/result)
+# RESULT_CACHE_MB : 容量上限(MB) (既定値: 64)
+resultCache = DiskCache("result", os.getenv("RESULT_CACHE_DIR", "./cache/result"),
+                        int(os.getenv("RESULT_CACHE_MB", "64")) * 1024 * 1024)
+
+# ジョブ管理 (学習・最適化のバックグラウンド実行)
+# JOB_WORKERS: 同時に実行するジョブ数 (既定値: 2)
+# JOB_QUEUE  : 実行待ちを含めて受け付けるジョブ数の上限 (既定値: 20)
+# JOB_TTL    : 終了したジョブの結果を保持する秒数 (既定値: 3600)
+jobManager = JobManager(int(os.getenv("JOB_WORKERS", "2")), int(os.getenv("JOB_QUEUE", "20")),
+                        float(os.getenv("JOB_TTL", "3600")))
+
+# Server-Sent Eventsの接続維持の送信間隔(秒)
+SSE_KEEPALIVE = 15
+
+# Arrow IPC形式のメディアタイプ
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+
+# 機能：起動処理
+# 概要：アプリケーション起動時に、共有のDBエンジン(コネクションプール)を生成する。
+#      RAY_INIT_ON_STARTUPが指定されている場合、共有のRayランタイムも起動する(未指定の場合は初回の最適化時に起動)。
+@app.on_event("startup")
+def Startup():
+    InitEngine()
+    if os.getenv("RAY_INIT_ON_STARTUP", "False") == "True":
+        InitRay()
+
+
+# 機能：終了処理
+# 概要：アプリケーション終了時に、ジョブを停止し共有のDBエンジンおよびRayランタイムを終了する。
+@app.on_event("shutdown")
+def Shutdown():
+    jobManager.Shutdown()
+    DisposeEngine()
+    ShutdownRay()
+
 
 # リクエストクラス
 class RequestData(BaseModel):
     req: str
     selectData: str
     arg: Optional[List[Union[str, float, int]]] = None
+    # レスポンス形式 (インポート・前処理・学習のみ有効。未指定の場合はJSON)
+    # 学習は列指向形式のみ有効で、ターゲット予測値／正解値を型付き配列で返す
+    fmt: Optional[str] = None
+    # ページ単位の取得位置・件数 (インポートのみ有効。件数が未指定の場合は全件)
+    offset: Optional[int] = None
+    limit: Optional[int] = None
+    # 予測対象の行データ (予測のみ有効。列名: 値の辞書のリスト)
+    rows: Optional[List[Dict[str, Any]]] = None
+    # 最適化の予算 (最適化のみ有効。最大試行数、最大実行時間(秒)、目標損失値 未指定の場合は既定値)
+    maxTrials: Optional[int] = None
+    maxSeconds: Optional[float] = None
+    targetLoss: Optional[float] = None
 
 
 # レスポンスクラス
@@ -44,6 +120,16 @@ class ResponseModel(BaseModel):
     arg: List[List[Union[str, float, int]]]
 
 
+# ジョブ リクエストクラス
+class JobRequestData(BaseModel):
+    jobId: str
+
+
+# キャッシュクリア リクエストクラス
+class CacheClearData(BaseModel):
+    selectData: Optional[str] = None
+
+
 # 機能：WebAPI受信処理
 # 概要：クライアントからのWebAPIを受信し、対応する処理を実施する。
 @app.post("/api")
@@ -54,16 +140,47 @@ def webApi(request: RequestData):
     
     # インポート
     if request.req == FETCH_REQ.Import.value:
+        # ページ単位の取得が指定されている場合
+        if request.limit is not None:
+            try:
+                # ページ取得処理・行数取得処理
+                df = GetDataframePage(request.selectData, request.offset or 0, request.limit)
+                total = GetRowCount(request.selectData)
+            except Exception as errMsg:
+                return {"res": "error", "arg": str(errMsg)}
+
+            # 欠損値に「None」を設定し、ページの行データおよび全体の行数をレスポンスで返す
+            df = df.astype(object).where(df.notna(), None)
+            return {"res": FETCH_REQ.Import.value, "arg": df.values.tolist(),
+                    "offset": request.offset or 0, "total": total}
+
         try:
             # データフレーム取得処理
             df = GetDataframe(request.selectData)
         except Exception as errMsg:
             return {"res": "error", "arg": errMsg}
 
+        # Arrow IPC形式のレスポンスを返す
+        if (request.fmt == RES_FORMAT.arrow.value) and ArrowAvailable():
+            return Response(EncodeArrow(df, {"res": FETCH_REQ.Import.value}), media_type=ARROW_MEDIA_TYPE)
+
+        # 列指向JSON形式のレスポンスを返す
+        if request.fmt in (RES_FORMAT.columnar.value, RES_FORMAT.arrow.value):
+            return {"res": FETCH_REQ.Import.value, "fmt": RES_FORMAT.columnar.value, "arg": EncodeColumnar(df)}
+
         # 欠損値に「None」を設定し(JSONに変換するため)、レスポンスを返す
         df.replace(np.nan, None, inplace=True)
         return {"res": FETCH_REQ.Import.value, "arg": df.values.tolist()}
 
+    # 行数取得
+    elif request.req == FETCH_REQ.Count.value:
+        try:
+            total = GetRowCount(request.selectData)
+        except Exception as errMsg:
+            return {"res": "error", "arg": str(errMsg)}
+
+        return {"res": FETCH_REQ.Count.value, "arg": total}
+
     # 前処理
     elif request.req == FETCH_REQ.Preproc.value:
         try:
@@ -75,98 +192,386 @@ def webApi(request: RequestData):
         # 分析問題取得処理
         problem, uniqueNum = GetProblem(df_preproc, target)
 
+        # Arrow IPC形式のレスポンスを返す (前処理内容、分析問題はメタデータに格納)
+        if (request.fmt == RES_FORMAT.arrow.value) and ArrowAvailable():
+            meta = {"res": FETCH_REQ.Preproc.value, "arg": [preprocCont, [problem.value, int(uniqueNum)]]}
+            return Response(EncodeArrow(df_preproc, meta), media_type=ARROW_MEDIA_TYPE)
+
+        # 列指向JSON形式のレスポンスを返す (行データのみ列指向形式とする)
+        if request.fmt in (RES_FORMAT.columnar.value, RES_FORMAT.arrow.value):
+            return {"res": FETCH_REQ.Preproc.value, "fmt": RES_FORMAT.columnar.value,
+                    "arg": [df_preproc.columns.tolist(), EncodeColumnar(df_preproc), preprocCont, [problem, uniqueNum]]}
+
         # 前処理データの列名・行データ、前処理内容、分析問題をレスポンスで返す
         return {"res": FETCH_REQ.Preproc.value,
                 "arg": [df_preproc.columns.tolist(), df_preproc.values.tolist(), preprocCont, [problem, uniqueNum]]}
 
     # 最適化
     elif request.req == FETCH_REQ.Optimize.value:
-        try:
-            # 前処理データ取得処理
-            df_preproc, _ = GetPreprocData(request.selectData, target)
-        except Exception as errMsg:
-            return {"res": "error", "arg": errMsg}
-
-        # 引数辞書取得処理
-        paramDict = GetParamDict(request.arg, True)
-        # 最適化処理
-        config = Optimize(df_preproc, paramDict)
-        
-        # 最適化結果をレスポンスで返す
-        return {"res": FETCH_REQ.Optimize.value, "arg": config}
+        return ExecOptimize(request)
         
     # 学習
     elif request.req == FETCH_REQ.Learning.value:
-        try:
-            # 前処理データ取得処理
-            df_preproc, _ = GetPreprocData(request.selectData, target)
-        except Exception as errMsg:
-            return {"res": "error", "arg": errMsg}
+        return ExecLearning(request)
         
-        # パラメータ辞書取得処理
-        paramDict = GetParamDict(request.arg, False)
+    # 予測
+    elif request.req == FETCH_REQ.Predict.value:
+        return ExecPredict(request)
         
-        # 学習実行
+    # エラーをレスポンスで返す
+    return {"res": "Invalid", "arg": request.req}
+
+# 機能：最適化実行処理
+# 概要：選択データの前処理データを取得し、指定されたモデルの最適化を行う。
+#      ジョブが指定されている場合、試行毎の進捗をジョブに記録する。
+def ExecOptimize(request, job=None):
+    try:
+        # データキー取得処理 (テーブルのバージョンはリクエスト毎に1回のみ取得)
+        dataKey = GetDataKey(request.selectData)
+        # 前処理データ取得処理
+        df_preproc, _ = GetPreprocData(request.selectData, request.arg[0], dataKey)
+    except Exception as errMsg:
+        return {"res": "error", "arg": str(errMsg)}
+
+    # 引数辞書取得処理
+    paramDict = GetParamDict(request.arg, True)
+    # 最適化処理 (最良スコアの設定と、予算の使用量を取得)
+    config, budget = Optimize(df_preproc, paramDict, job, dataKey,
+                              request.maxTrials, request.maxSeconds, request.targetLoss)
+    
+    # 予算内に完了した試行がない場合
+    if config is None:
+        return {"res": "error", "arg": "予算内に完了した試行がありません", "budget": budget}
+    
+    # 最適化結果および、予算の使用量をレスポンスで返す
+    return {"res": FETCH_REQ.Optimize.value, "arg": config, "budget": budget}
+
+
+# 機能：学習実行処理
+# 概要：選択データの前処理データを取得し、指定されたモデルで学習を行う。
+#      ジョブが指定されている場合、エポック毎の進捗をジョブに記録する。
+def ExecLearning(request, job=None):
+    # パラメータ辞書取得処理
+    paramDict = GetParamDict(request.arg, False)
+    # ターゲット予測値／正解値を型付き配列で返すか (列指向形式が指定された場合)
+    compact = (request.fmt == RES_FORMAT.columnar.value)
+
+    try:
+        # データキー取得処理 (テーブルのバージョンはリクエスト毎に1回のみ取得)
+        dataKey = GetDataKey(request.selectData)
+        # 学習済みモデルの保存先のモデルキー
+        modelKey = GetModelKey(dataKey, paramDict)
+
+        # 同一条件の学習結果がキャッシュに存在し、学習済みモデルも保存されている場合、再学習せずに返す
+        resultKey = GetResultKey(request.selectData, modelKey, compact)
+        cached = resultCache.Get(resultKey)
+        if (cached is not None) and ModelExists(modelKey):
+            return cached
+
+        # 前処理データ取得処理
+        df_preproc, _ = GetPreprocData(request.selectData, request.arg[0], dataKey)
+        # 前処理状態取得処理 (学習済みモデルと併せて保存)
+        preproc = GetPreprocState(request.selectData, request.arg[0], dataKey)
+    except Exception as errMsg:
+        return {"res": "error", "arg": str(errMsg)}
+    
+    # 学習実行 (実行中の学習として、学習実行が使用するCPU数の分割対象とする)
+    with ReserveLearningCpus():
         if paramDict["model"] == MODEL.nn.value:
             # ニューラルネットワークの場合
-            metrics = ExecLearning_Nn(df_preproc, paramDict)
+            metrics = ExecLearning_Nn(df_preproc, paramDict, job, dataKey, compact, modelKey, preproc)
             
         else:
             # ニューラルネットワーク以外の場合
-            metrics = ExecLearning_Trdt(df_preproc, paramDict)
-        
-        # JSON形式に変換できない場合(異常値を含む場合)、エラーをレスポンスで返す
-        try:
-            json.dumps(metrics, allow_nan=False)
-            
-        except ValueError:
-            return {"res": FETCH_REQ.Learning.value + " ValueError", "arg": []}
-        
-        # 学習結果の指標をレスポンスで返す
-        return {"res": FETCH_REQ.Learning.value, "arg": metrics}
+            if job is not None:
+                job.Progress(0, 1, "fit")
+            metrics = ExecLearning_Trdt(df_preproc, paramDict, dataKey, compact, modelKey, preproc)
+            if job is not None:
+                job.Progress(1, 1, "fit")
+    
+    # JSON形式に変換できない場合(異常値を含む場合)、エラーをレスポンスで返す
+    try:
+        json.dumps(metrics, allow_nan=False)
         
-    # エラーをレスポンスで返す
-    return {"res": "Invalid", "arg": request.req}
+    except ValueError:
+        return {"res": FETCH_REQ.Learning.value + " ValueError", "arg": []}
+    
+    if compact:
+        response = {"res": FETCH_REQ.Learning.value, "fmt": RES_FORMAT.columnar.value, "arg": metrics}
+    else:
+        response = {"res": FETCH_REQ.Learning.value, "arg": metrics}
+    # 学習結果をキャッシュに格納 (ジョブがキャンセルされた場合を除く)
+    if (job is None) or (not job.Cancelled()):
+        resultCache.Set(resultKey, response)
+    
+    # 学習結果の指標をレスポンスで返す
+    return response
+
+
+# 機能：学習結果キー取得処理
+# 概要：学習結果のキャッシュのキーを取得する。
+#      モデルキー(データ・パラメータ)、レスポンス形式、学習エンジンが同一の場合、同一のキーとなる。
+#      テーブル毎に破棄できるよう、テーブル名を先頭に付与する。
+def GetResultKey(selectData, modelKey, compact):
+    keySource = json.dumps([modelKey, compact, NN_ENGINE])
+    return selectData + "-" + hashlib.sha1(keySource.encode("utf-8")).hexdigest()
+
+
+# 機能：予測実行処理
+# 概要：学習時と同じ引数(ターゲット、モデル、パラメータ)で学習済みモデルを特定し、リクエストの行データのターゲットを予測する。
+#      行データは、学習済みモデルと併せて保存した前処理状態で前処理を行った後に予測する。
+#      学習済みモデル(前処理状態を含む)がない場合はエラーを返す。
+def ExecPredict(request):
+    try:
+        # パラメータ辞書取得処理・モデルキー取得処理
+        paramDict = GetParamDict(request.arg, False)
+        modelKey = GetModelKey(GetDataKey(request.selectData), paramDict)
+        # 学習済みモデル読み込み
+        loaded = LoadPredictModel(modelKey)
+        if (loaded is None) or (loaded["info"].get("preproc") is None):
+            return {"res": FETCH_REQ.Predict.value + " NotFound", "arg": []}
+
+        # 行データの前処理
+        df_rows = PreprocRows(loaded["info"]["preproc"], request.rows or [])
+        # 学習済みモデルによる予測
+        yPred = PredictModel(loaded, df_rows)
+    except Exception as errMsg:
+        return {"res": "error", "arg": str(errMsg)}
+
+    # ターゲット予測値をレスポンスで返す
+    return {"res": FETCH_REQ.Predict.value, "arg": yPred}
+
+
+# 機能：ジョブ投入処理
+# 概要：学習・最適化のリクエストをバックグラウンドで実行するジョブとして投入し、ジョブIDを即時に返す。
+@app.post("/job/submit")
+def jobSubmit(request: RequestData):
+    # 学習・最適化以外のリクエストはジョブとして受け付けない
+    if request.req == FETCH_REQ.Optimize.value:
+        func = lambda job: ExecOptimize(request, job)
+    elif request.req == FETCH_REQ.Learning.value:
+        func = lambda job: ExecLearning(request, job)
+    else:
+        return {"res": "Invalid", "arg": request.req}
+
+    # ジョブ投入 (受付上限を超えた場合、エラーをレスポンスで返す)
+    job = jobManager.Submit(request.req, func)
+    if job is None:
+        return {"res": "Busy", "arg": request.req}
+
+    return {"res": "JobSubmit", "arg": job.GetStatus()}
+
+
+# 機能：ジョブ状態取得処理
+# 概要：ジョブの状態および進捗を返す。
+@app.post("/job/status")
+def jobStatus(request: JobRequestData):
+    job = jobManager.Get(request.jobId)
+    if job is None:
+        return {"res": "NotFound", "arg": request.jobId}
+
+    return {"res": "JobStatus", "arg": job.GetStatus()}
+
+
+# 機能：ジョブ結果取得処理
+# 概要：終了したジョブの結果(同期実行時と同じレスポンス)を返す。未終了の場合は状態を返す。
+@app.post("/job/result")
+def jobResult(request: JobRequestData):
+    job = jobManager.Get(request.jobId)
+    if job is None:
+        return {"res": "NotFound", "arg": request.jobId}
+
+    if job.status != JOB_STATUS.done.value:
+        return {"res": "JobStatus", "arg": job.GetStatus()}
+
+    return job.result
+
+
+# 機能：ジョブイベント配信処理
+# 概要：ジョブのイベント(学習のエポック毎の指標など)を、発生次第Server-Sent Eventsで配信する。
+#      ジョブが終了した場合、終了イベントを配信して切断する。
+#      startに受信済みのイベント数を指定すると、その続きから配信する。
+@app.get("/job/events/{jobId}")
+async def jobEvents(jobId: str, start: int = 0):
+    job = jobManager.Get(jobId)
+    if job is None:
+        return {"res": "NotFound", "arg": jobId}
+
+    return StreamingResponse(StreamJobEvents(job, start), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# ジョブイベントをServer-Sent Events形式で順次生成
+# イベント待ちは非同期で行い、接続中のクライアントがスレッドプールのスレッドを占有しないようにする
+async def StreamJobEvents(job, start):
+    while True:
+        events = await job.WaitEventsAsync(start, SSE_KEEPALIVE)
+
+        # イベントがない場合、ジョブ終了済みであれば切断し、実行中であれば接続維持のコメントを送信
+        if len(events) <= 0:
+            if job.Finished():
+                return
+            yield ": keepalive\n\n"
+            continue
+
+        for event in events:
+            yield f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+            # 終了イベントを配信した場合、切断
+            if event["event"] == "end":
+                return
+        start = events[-1]["id"] + 1
+
+
+# 機能：ジョブキャンセル処理
+# 概要：実行待ちまたは実行中のジョブをキャンセルする。
+@app.post("/job/cancel")
+def jobCancel(request: JobRequestData):
+    job = jobManager.Cancel(request.jobId)
+    if job is None:
+        return {"res": "NotFound", "arg": request.jobId}
+
+    return {"res": "JobCancel", "arg": job.GetStatus()}
+
+
+# 機能：メトリクス取得処理
+# 概要：監視向けに、DBコネクションプールおよびキャッシュの利用状況を返す。
+@app.get("/metrics")
+def metrics():
+    return {"dbPool": GetPoolMetrics(), "caches": GetCacheMetrics()}
+
+
+# 機能：キャッシュクリア処理
+# 概要：入力データ・前処理データ・分割データ・近傍探索結果・学習結果のキャッシュを破棄する。
+#      選択データが指定されている場合、そのデータのキャッシュのみ破棄する。
+@app.post("/cache/clear")
+def cacheClear(request: CacheClearData):
+    if request.selectData:
+        datasetCache.Invalidate(lambda key: key == request.selectData)
+        preprocCache.Invalidate(lambda key: key[0] == request.selectData)
+        splitCache.Invalidate(lambda key: key[0][0] == request.selectData)
+        neighborCache.Invalidate(lambda key: key[0][0] == request.selectData)
+        resultCache.Invalidate(lambda key: key.startswith(request.selectData + "-"))
+    else:
+        datasetCache.Invalidate()
+        preprocCache.Invalidate()
+        splitCache.Invalidate()
+        neighborCache.Invalidate()
+        resultCache.Invalidate()
+
+    return {"res": "CacheClear", "arg": GetCacheMetrics()}
 
 
 # 機能：データフレーム取得処理
 # 概要：選択データをDBから取得し、データフレームとして格納する。
-def GetDataframe(selectData):
-    # DB接続情報を取得
-    userName = os.getenv("DB_USERNAME")
-    password = os.getenv("DB_PASSWORD")
-    host = os.getenv("DB_HOST")
-    dbName = os.getenv("DB_NAME")
-    
+#      キャッシュに有効なデータが存在する場合は、DBから取得せずにキャッシュを使用する。
+#      データキーが指定されている場合、データキーのテーブルのバージョンを使用し、DBからバージョンを取得しない。
+def GetDataframe(selectData, dataKey=None):
     try:
-        # DBから入力データ取得
-        engine = create_engine(f"postgresql://{userName}:{password}@{host}/{dbName}")
-        df = pd.read_sql_query("SELECT * FROM " + selectData, engine)
+        # テーブルのバージョンを取得し、キャッシュから入力データ取得
+        version = dataKey[2] if dataKey is not None else GetDatasetVersion(selectData)
+        df = datasetCache.Get(selectData, version)
+
+        # キャッシュに存在しない場合、共有のプールから接続を取得してDBから入力データ取得しキャッシュに格納
+        if df is None:
+            with Connect() as conn:
+                df = pd.read_sql_query("SELECT * FROM " + selectData, conn)
+            datasetCache.Set(selectData, df, version)
 
     except SQLAlchemyError as errMsg:
         print(f"データベース操作中にエラーが発生しました: {selectData}, {errMsg}")
-        
+        raise
+
     except Exception as errMsg:
         print(f"予期しないエラーが発生しました: {selectData}, {errMsg}")
-        
-    finally:
-        # DB接続を終了
-        engine.dispose()
-    
-    return df
+        raise
+
+    # 呼び出し元での変更がキャッシュに影響しないよう、複製を返す
+    return df.copy()
+
+
+# 機能：ページ取得処理
+# 概要：選択データをキー列の昇順に並べ、指定位置から指定件数の行をDBから取得する。
+#      取得範囲の絞り込みはDB側(LIMIT/OFFSET)で行う。
+def GetDataframePage(selectData, offset, limit):
+    # 選択データが入力データではない場合、エラー
+    if selectData not in INPUT_DATA_KEY:
+        raise ValueError(f"不正な選択データです: {selectData}")
+
+    query = text(f'SELECT * FROM {selectData} ORDER BY "{INPUT_DATA_KEY[selectData]}" LIMIT :limit OFFSET :offset')
+    with Connect() as conn:
+        return pd.read_sql_query(query, conn, params={"limit": max(limit, 0), "offset": max(offset, 0)})
+
+
+# 機能：行数取得処理
+# 概要：選択データの行数を取得する。キャッシュに入力データが存在する場合はその行数を返す。
+def GetRowCount(selectData):
+    if selectData not in INPUT_DATA_KEY:
+        raise ValueError(f"不正な選択データです: {selectData}")
+
+    with Connect() as conn:
+        version = GetTableVersion(conn, selectData) if datasetVersionCheck else None
+        df = datasetCache.Get(selectData, version)
+        if df is not None:
+            return len(df)
+
+        return conn.execute(text(f"SELECT COUNT(*) FROM {selectData}")).scalar()
+
+
+# 機能：データセットバージョン取得処理
+# 概要：選択データのテーブルのバージョンを取得する。バージョン確認を行わない場合はNoneを返す。
+def GetDatasetVersion(selectData):
+    if not datasetVersionCheck:
+        return None
+
+    with Connect() as conn:
+        return GetTableVersion(conn, selectData)
+
+
+# 機能：データキー取得処理
+# 概要：前処理データを一意に識別するデータキー(テーブル名、前処理辞書のバージョン、テーブルのバージョン)を取得する。
+#      前処理辞書またはテーブルが更新された場合はデータキーが変わり、分割データのキャッシュは使用されない。
+def GetDataKey(selectData):
+    return (selectData, GetPreprocDictVersion(selectData), GetDatasetVersion(selectData))
 
 
 # 機能：前処理データ取得処理
 # 概要：選択データのデータフレームを取得し、ターゲットに基づき前処理を行う。
-def GetPreprocData(selectData, target):
+#      同一の選択データ・ターゲット・前処理辞書の前処理結果はキャッシュし、再計算しない。
+#      データキーが指定されていない場合はデータキーを取得し、データフレーム取得処理にも同じデータキーを使用する。
+def GetPreprocData(selectData, target, dataKey=None):
     try:
+        # キャッシュから前処理データ取得
+        if dataKey is None:
+            dataKey = GetDataKey(selectData)
+        cacheKey = (selectData, target, dataKey[1])
+        version = dataKey[2]
+        cached = preprocCache.Get(cacheKey, version)
+        if cached is not None:
+            df, preprocCont = cached
+            return df.copy(), list(preprocCont)
+
         # データフレーム取得処理
-        df = GetDataframe(selectData)
+        df = GetDataframe(selectData, dataKey)
     except Exception as errMsg:
         raise Exception(errMsg)
     
+    # 前処理
+    df, preprocCont = ExecPreproc(selectData, df, target)
+
+    # 前処理結果をキャッシュに格納
+    preprocCache.Set(cacheKey, (df, preprocCont), version)
+
+    return df.copy(), list(preprocCont)
+
+
+# 機能：前処理実行処理
+# 概要：基本前処理および、選択データに応じた特殊前処理を実施する。
+def ExecPreproc(selectData, df, target):
     # 基本前処理
-    df, preprocCont = PreprocBasic(selectData, df, target)
+    if preprocCompiled:
+        df, preprocCont = ExecPreprocPlan(CompilePreprocPlan(selectData, target), df)
+    else:
+        df, preprocCont = PreprocBasic(selectData, df, target)
     # 特殊前処理
     if selectData == INPUT_DATA.titanic.value:
         df, preprocCont = PreprocExtra(df, target, preprocCont)
@@ -174,6 +579,188 @@ def GetPreprocData(selectData, target):
     return df, preprocCont
 
 
+# 機能：前処理状態取得処理
+# 概要：選択データ・ターゲットの前処理の学習結果(前処理状態取得処理を参照)を取得する。
+#      同一の選択データ・ターゲット・前処理辞書の結果はキャッシュし、再計算しない。
+#      データキーが指定されていない場合はデータキーを取得し、データフレーム取得処理にも同じデータキーを使用する。
+def GetPreprocState(selectData, target, dataKey=None):
+    if dataKey is None:
+        dataKey = GetDataKey(selectData)
+    cacheKey = (selectData, target, dataKey[1], "state")
+    version = dataKey[2]
+    state = preprocCache.Get(cacheKey, version)
+    if state is None:
+        state = FitPreprocState(selectData, GetDataframe(selectData, dataKey), target)
+        preprocCache.Set(cacheKey, state, version)
+
+    return state
+
+
+# 機能：前処理学習処理
+# 概要：選択データ全体で前処理を学習し、予測対象の行データに同じ前処理を適用するための前処理状態を取得する。
+#      最頻値・中央値などの設定値、インデックス値・ワンホットエンコーディングの分類、分位数によるビンの境界値を保持する。
+#      前処理状態は学習済みモデルと併せて保存するため、Pythonの基本型(リスト・辞書・数値・文字列)のみで構成する。
+#
+# columns: 予測対象の行データの列 (ターゲットを除く元データの列)
+# steps  : 前処理の順に並べた処理のリスト
+#   ["value", 列名, 設定値] / ["groupMedian", 列名, グループ列名, [[グループ値, 中央値], ...], 全体の中央値]
+#   ["drop", 列名] / ["index", 列名, 分類リスト] / ["onehot", 列名, 分類リスト, 削除する分類]
+#   ["cut", 列名, 境界値リスト, ラベルリスト] / ["title"] / ["familySize"] / ["deck"]
+#
+def FitPreprocState(selectData, df, target):
+    df = df.copy()
+    columns = [str(col) for col in df.columns if col != target]
+
+    # 基本前処理 (前処理プランの順に学習し、学習した前処理を適用)
+    planSteps = [list(step) for step in CompilePreprocPlan(selectData, target)["steps"]]
+    # 特殊前処理 (タイタニック号 乗客リスト)
+    if selectData == INPUT_DATA.titanic.value:
+        planSteps.append(["title"])
+        if target != "Age":
+            planSteps.append(["groupMedian", "Age", "Title"])
+            planSteps.append(["cut", "Age", [0, 10, 20, 40, 60, float("inf")], [0, 1, 2, 3, 4]])
+        else:
+            planSteps.append(["dropna", "Age"])
+        planSteps.append(["onehot", "Title", None])
+        if (target != "SibSp") and (target != "Parch"):
+            planSteps.append(["familySize"])
+        planSteps.append(["value", "Cabin", "U"])
+        planSteps.append(["deck"])
+        planSteps.append(["onehot", "Deck", None])
+        planSteps.append(["drop", "Cabin"])
+
+    steps = []
+    for step in planSteps:
+        kind, field = step[0], (step[1] if len(step) > 1 else None)
+
+        # 欠損値を含むデータを削除 (ターゲットのみが対象のため、予測時は適用しない)
+        if kind == "dropna":
+            df = df.dropna(subset=[field])
+            continue
+
+        # 最頻値設定 (学習時の最頻値を設定値とする)
+        if kind == "mode":
+            step = ["value", field, ToPythonValue(df[field].mode()[0])]
+
+        # 指定列でグループ化した中央値設定 (グループ毎の中央値と全体の中央値)
+        elif kind == "groupMedian":
+            medians = df.groupby(step[2])[field].median().dropna()
+            step = ["groupMedian", field, step[2],
+                    [[ToPythonValue(group), ToPythonValue(median)] for group, median in medians.items()],
+                    ToPythonValue(df[field].median())]
+
+        # インデックス値設定 (LabelEncoderの分類)
+        elif kind == "index":
+            step = ["index", field, [ToPythonValue(value) for value in LabelEncoder().fit(df[field]).classes_]]
+
+        # ワンホットエンコーディング (欠損値を除く分類の昇順)
+        elif kind == "onehot":
+            _, uniques = pd.factorize(df[field], sort=True)
+            step = ["onehot", field, [ToPythonValue(value) for value in uniques], step[2]]
+
+        # ビン分割 (分位数の場合は学習時の境界値とし、範囲外の値は両端のビンとする)
+        elif kind == "cut":
+            if type(step[2]) is int:
+                _, edges = pd.qcut(df[field], step[2], retbins=True)
+                edges = [-math.inf] + [float(edge) for edge in edges[1:-1]] + [math.inf]
+                step = ["cut", field, edges, list(range(step[2]))]
+            else:
+                step = ["cut", field, list(step[2]), list(step[3])]
+
+        steps.append(step)
+        df = ApplyPreprocStep(step, df)
+
+    return {"columns": columns, "steps": steps}
+
+
+# 機能：前処理適用処理
+# 概要：前処理状態の1件の処理をデータフレームに適用する。
+#      対象列がない処理(予測対象の行データにないターゲットの処理)は適用しない。
+#      インデックス値・ワンホットエンコーディングで学習時にない分類がある場合、例外を送出する。
+def ApplyPreprocStep(step, df):
+    kind = step[0]
+    field = step[1] if len(step) > 1 else None
+    if (field is not None) and (field not in df.columns):
+        return df
+
+    # 指定値設定
+    if kind == "value":
+        df[field] = df[field].fillna(step[2])
+
+    # 指定列でグループ化した中央値設定 (グループの中央値がない場合は全体の中央値)
+    elif kind == "groupMedian":
+        groupMedians = dict((group, median) for group, median in step[3])
+        medians = df[step[2]].map(groupMedians) if step[2] in df.columns else pd.Series(np.nan, index=df.index)
+        df[field] = np.where(df[field].isna(), np.where(medians.isna(), step[4], medians), df[field])
+
+    # 列削除
+    elif kind == "drop":
+        df = df.drop(columns=[field])
+
+    # インデックス値設定
+    elif kind == "index":
+        codes = GetPreprocCodes(df[field], step[2], field)
+        df[field] = codes.astype(np.int64)
+
+    # ワンホットエンコーディング (欠損値は全列0)
+    elif kind == "onehot":
+        codes = GetPreprocCodes(df[field], step[2], field, allowNa=True)
+        df = df.drop(columns=[field])
+        for code, value in enumerate(step[2]):
+            if (step[3] is None) or (f"{field}_{value}" != f"{field}_{step[3]}"):
+                df[f"{field}_{value}"] = (codes == code).astype(int)
+
+    # ビン分割
+    elif kind == "cut":
+        binned = pd.cut(df[field], bins=step[2], labels=step[3], include_lowest=True)
+        if binned.isna().any():
+            raise ValueError(f"「{field}」に分割範囲外の値があります。")
+        df[field + "Bin"] = binned.astype(int)
+        df = df.drop(columns=[field])
+
+    # 「氏名」から「敬称」を抽出
+    elif kind == "title":
+        df["Title"] = df["Name"].str.extract(r" ([A-Za-z]+)\.", expand=False)
+        df = df.drop(columns=["Name"])
+
+    # 「自分を含む同乗の家族の人数」列を追加
+    elif kind == "familySize":
+        df["FamilySize"] = (df["SibSp"] + df["Parch"] + 1).astype(int)
+
+    # 「客室番号」の先頭文字を「甲板」列として追加
+    elif kind == "deck":
+        df["Deck"] = df["Cabin"].str[0]
+
+    return df
+
+
+# 学習時の分類リストから分類コードを取得 (学習時にない分類がある場合は例外を送出)
+def GetPreprocCodes(col, values, field, allowNa=False):
+    codes = pd.Index(values).get_indexer(col)
+    unknown = (codes < 0) & (col.notna().values if allowNa else True)
+    if unknown.any():
+        raise ValueError(f"「{field}」に学習時にない値があります: {sorted(set(map(str, col[unknown])))}")
+    return codes
+
+
+# NumPyの値をPythonの基本型に変換
+def ToPythonValue(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+# 機能：行データ前処理
+# 概要：予測対象の行データに、学習済みモデルと併せて保存した前処理状態を適用する。
+#      前処理は学習時の値(分類・境界値・設定値)に基づくため、同一の行データは他の行データによらず同一の結果となる。
+def PreprocRows(state, rows):
+    # 行データのデータフレームを作成 (指定されていない列は欠損値)
+    df = pd.DataFrame(rows, columns=state["columns"])
+
+    for step in state["steps"]:
+        df = ApplyPreprocStep(step, df)
+
+    return df
+
+
 # 機能：基本前処理
 # 概要：基本的(汎用的)な前処理を実施する。
 def PreprocBasic(selectData, df, target):
@@ -272,6 +859,198 @@ def PreprocBasic(selectData, df, target):
     return df, preprocCont
 
 
+# 機能：前処理プラン生成処理
+# 概要：前処理辞書をターゲットに基づいて解決し、一括処理用の前処理プランを生成する。
+#      前処理内容はデータに依存しないため、プラン生成時に確定させる。
+#
+# steps: 前処理辞書の順に並べた処理のタプル
+#   ("mode", 列名) / ("value", 列名, 設定値) / ("groupMedian", 列名, グループ列名) / ("dropna", 列名)
+#   ("drop", 列名) / ("index", 列名) / ("onehot", 列名, 削除する列の分類名) / ("cut", 列名, ビン, ラベル)
+#
+@lru_cache(maxsize=None)
+def CompilePreprocPlan(selectData, target):
+    steps = []
+    preprocCont = []
+
+    for item in GetPreprocDict(selectData):
+        # 欠損値の処置
+        if item.get("fillna") is not None:
+            if (target != item["field"]) or (item.get("targetNotDrop") is not None):
+                if item["fillna"] == "mode":
+                    steps.append(("mode", item["field"]))
+                    preprocCont.append("・「" + item["headerName"] + "」の欠損値に最頻値を設定しました。")
+
+                elif item["fillna"] == "groupMedian":
+                    steps.append(("groupMedian", item["field"], item["group"]))
+                    preprocCont.append("・「" + item["headerName"] + "」の欠損値に「" + item["groupName"] + "」毎にグループ化した中央値を設定しました。")
+                    preprocCont.append("　「" + item["groupName"] + "」毎の中央値が設定できない場合、「" + item["headerName"] + "」全体の中央値を設定しました。")
+
+                else:
+                    steps.append(("value", item["field"], item["fillna"]))
+                    preprocCont.append("・「" + item["headerName"] + "」の欠損値に「" + str(item["fillna"]) + "」を設定しました。")
+
+            else:
+                steps.append(("dropna", item["field"]))
+                preprocCont.append("・「" + item["headerName"] + "」が欠損値であるデータを削除しました。")
+
+        if item.get("proc") is None:
+            continue
+
+        # 列削除
+        if item["proc"] == "drop":
+            steps.append(("drop", item["field"]))
+            preprocCont.append("・「" + item["headerName"] + "」はターゲットと関係性が低いため削除しました。")
+
+        # インデックス値設定 (ターゲット列のワンホットエンコーディングを含む)
+        elif (item["proc"] == "index") or ((item["proc"] == "onehot") and (target == item["field"])):
+            steps.append(("index", item["field"]))
+            preprocCont.append("・「" + item["headerName"] + "」をインデックス値に変換しました。")
+
+        # ワンホットエンコーディング
+        elif item["proc"] == "onehot":
+            steps.append(("onehot", item["field"], item.get("drop")))
+            preprocCont.append("・「" + item["headerName"] + "」をワンホットエンコーディングしました。")
+
+        # ビン分割
+        elif (item["proc"] == "cut") and (target != item["field"]):
+            bins = item["bins"] if type(item["bins"]) is int else tuple(item["bins"])
+            steps.append(("cut", item["field"], bins, tuple(item.get("labels") or ())))
+            preprocCont.append(item["cont1"])
+            if item.get("cont2") is not None:
+                preprocCont.append(item["cont2"])
+            if item.get("cont3") is not None:
+                preprocCont.append(item["cont3"])
+            preprocCont.append("・「" + item["headerName"] + "」を削除しました。")
+
+    return {"steps": tuple(steps), "preprocCont": tuple(preprocCont)}
+
+
+# 機能：前処理プラン実行処理
+# 概要：前処理プランに基づき、基本前処理を一括で実施する。結果はPreprocBasicと同一となる。
+#      変更する列のみを個別に処理し、データフレーム全体の複製は行わない。
+#      追加列(ワンホットエンコーディング・ビン)は事前確保した配列に書き込み、最後に一度だけデータフレームを構築する。
+def ExecPreprocPlan(plan, df):
+    # 変更後の列 (列名: シリーズ)
+    cols = {}
+    # 削除する元の列
+    removed = set()
+    # 追加列 (("onehot", 列名リスト, 分類コード, 削除する分類コード) / ("cut", 列名リスト, ビン分割結果))
+    newCols = []
+    # 残す行の位置 (Noneの場合は全行)
+    rowPos = None
+    index = df.index
+
+    for step in plan["steps"]:
+        kind, field = step[0], step[1]
+
+        # 最頻値設定
+        if kind == "mode":
+            col = GetPlanCol(df, cols, rowPos, field)
+            cols[field] = col.fillna(col.mode()[0])
+
+        # 指定値設定
+        elif kind == "value":
+            cols[field] = GetPlanCol(df, cols, rowPos, field).fillna(step[2])
+
+        # 指定列でグループ化した中央値設定
+        elif kind == "groupMedian":
+            col = GetPlanCol(df, cols, rowPos, field)
+            groupMedians = col.groupby(GetPlanCol(df, cols, rowPos, step[2])).transform("median")
+            cols[field] = pd.Series(np.where(col.isna(), np.where(groupMedians.isna(), col.median(), groupMedians), col),
+                                    index=index, name=field)
+
+        # 欠損値を含むデータを削除 (変更済みの列および追加列も同じ行を削除)
+        elif kind == "dropna":
+            notna = GetPlanCol(df, cols, rowPos, field).notna().values
+            rowPos = np.flatnonzero(notna) if rowPos is None else rowPos[notna]
+            index = df.index[rowPos]
+            cols = {name: col[notna] for name, col in cols.items()}
+            newCols = [newCol[:2] + tuple(value[notna] if isinstance(value, (np.ndarray, pd.Series)) else value
+                                          for value in newCol[2:]) for newCol in newCols]
+
+        # 列削除
+        elif kind == "drop":
+            removed.add(field)
+            cols.pop(field, None)
+
+        # インデックス値設定 (欠損値がない場合、昇順の分類コードはLabelEncoderの結果と一致する)
+        elif kind == "index":
+            col = GetPlanCol(df, cols, rowPos, field)
+            codes, _ = pd.factorize(col, sort=True)
+            if (len(codes) > 0) and (codes.min() < 0):
+                codes = LabelEncoder().fit_transform(col)
+            cols[field] = pd.Series(codes.astype(np.int64), index=index, name=field)
+
+        # ワンホットエンコーディング (分類を昇順に並べた分類コードを取得)
+        elif kind == "onehot":
+            codes, uniques = pd.factorize(GetPlanCol(df, cols, rowPos, field), sort=True)
+            names = [f"{field}_{unique}" for unique in uniques]
+            dropCode = None
+            if step[2] is not None:
+                if f"{field}_{step[2]}" not in names:
+                    raise KeyError(f"['{field}_{step[2]}'] not found in axis")
+                dropCode = names.index(f"{field}_{step[2]}")
+            newCols.append(("onehot", names, codes, dropCode))
+            removed.add(field)
+            cols.pop(field, None)
+
+        # ビン分割
+        elif kind == "cut":
+            col = GetPlanCol(df, cols, rowPos, field)
+            if type(step[2]) is int:
+                binned = pd.qcut(col, step[2], labels=list(range(step[2])))
+            else:
+                binned = pd.cut(col, bins=list(step[2]), labels=list(step[3]), include_lowest=True)
+            newCols.append(("cut", [field + "Bin"], binned))
+            removed.add(field)
+            cols.pop(field, None)
+
+    # 追加列の値を事前確保した配列に書き込み
+    newNames = []
+    for newCol in newCols:
+        newNames.extend(name for code, name in enumerate(newCol[1]) if (newCol[0] == "cut") or (code != newCol[3]))
+    newValues = np.zeros((len(index), len(newNames)), dtype=np.int64)
+
+    offset = 0
+    for newCol in newCols:
+        # ワンホットエンコーディング (該当する分類の列に1を設定)
+        if newCol[0] == "onehot":
+            _, names, codes, dropCode = newCol
+            colOffsets = np.full(len(names) + 1, -1)
+            keepCodes = [code for code in range(len(names)) if code != dropCode]
+            colOffsets[keepCodes] = offset + np.arange(len(keepCodes))
+            # 欠損値(分類コード-1)は全列0とする
+            targetCols = colOffsets[codes]
+            rows = np.flatnonzero(targetCols >= 0)
+            newValues[rows, targetCols[rows]] = 1
+            offset += len(keepCodes)
+
+        # ビン分割 (ビンのインデックス値を設定)
+        else:
+            newValues[:, offset] = newCol[2].astype(int).values
+            offset += 1
+
+    # 元の列(削除列を除く)と追加列から、データフレームを構築
+    data = {}
+    for field in df.columns:
+        if field not in removed:
+            data[field] = GetPlanCol(df, cols, rowPos, field)
+    for idx, name in enumerate(newNames):
+        data[name] = newValues[:, idx]
+
+    return pd.DataFrame(data, index=index), list(plan["preprocCont"])
+
+
+# 前処理プランの対象列を取得 (変更済みの列がある場合はその列、ない場合は元の列の残す行)
+def GetPlanCol(df, cols, rowPos, field):
+    if field in cols:
+        return cols[field]
+    if rowPos is None:
+        return df[field]
+
+    return df[field].iloc[rowPos]
+
+
 # 機能：特殊前処理
 # 概要：タイタニック号 乗客リスト向けの特殊な前処理を実施する。
 def PreprocExtra(df, target, preprocCont):
@@ -0,0 +1,88 @@
+###############################################################################
+# 機能：ベンチマーク
+# 概要：高速化した処理と従来の処理の実行時間を計測・比較する。
+#      例) python Benchmark.py preproc --data house --target SalePrice
+#          python Benchmark.py loader --data house --target SalePrice --miniBatch 32
+###############################################################################
+import argparse
+import time
+
+import pandas as pd
+
+from App import GetDataframe, GetPreprocData, PreprocBasic, CompilePreprocPlan, ExecPreprocPlan
+from Define import GetProblem
+from Learning import GetSplit_Nn, GetDataloaderSplit
+
+
+# 機能：実行時間計測処理
+# 概要：処理を指定回数実行し、1回あたりの平均実行時間(秒)を返す。
+def Measure(func, repeat):
+    # 初回実行(ウォームアップ)は計測しない
+    func()
+
+    startTime = time.perf_counter()
+    for _ in range(repeat):
+        func()
+
+    return (time.perf_counter() - startTime) / repeat
+
+
+# 機能：結果出力処理
+# 概要：従来の処理と高速化した処理の実行時間を出力する。
+def PrintResult(name, baseTime, fastTime):
+    print(f"{name}")
+    print(f"  従来      : {baseTime * 1000:.2f} ms")
+    print(f"  高速化    : {fastTime * 1000:.2f} ms")
+    print(f"  速度比    : {baseTime / fastTime:.2f} 倍")
+
+
+# 機能：前処理ベンチマーク
+# 概要：前処理辞書を逐次処理する基本前処理と、コンパイル済みプランによる基本前処理を比較する。
+def BenchPreproc(selectData, target, repeat):
+    df = GetDataframe(selectData)
+    plan = CompilePreprocPlan(selectData, target)
+
+    # 結果が同一であることを確認
+    dfBase, contBase = PreprocBasic(selectData, df.copy(), target)
+    dfFast, contFast = ExecPreprocPlan(plan, df.copy())
+    pd.testing.assert_frame_equal(dfBase, dfFast)
+    assert contBase == contFast
+
+    baseTime = Measure(lambda: PreprocBasic(selectData, df.copy(), target), repeat)
+    fastTime = Measure(lambda: ExecPreprocPlan(plan, df.copy()), repeat)
+    PrintResult(f"基本前処理 ({selectData}, ターゲット: {target}, {len(df)}行 × {len(df.columns)}列)", baseTime, fastTime)
+
+
+# 機能：データローダベンチマーク
+# 概要：ワーカを使用するデータローダと、メインプロセスでミニバッチを生成するデータローダを比較する。
+#      1回あたりの処理は、データローダの取得と訓練データ・検証データ・テストデータの1エポック分の走査とする。
+def BenchLoader(selectData, target, miniBatch, repeat):
+    df, _ = GetPreprocData(selectData, target)
+    problem, _ = GetProblem(df, target)
+    split = GetSplit_Nn(df, problem, target)
+
+    # 1エポック分の走査
+    def Epoch(inProcess):
+        _, trainLoader, valLoader, testLoader = GetDataloaderSplit(split, miniBatch, inProcess=inProcess)
+        for loader in (trainLoader, valLoader, testLoader):
+            for _ in loader:
+                pass
+
+    baseTime = Measure(lambda: Epoch(False), repeat)
+    fastTime = Measure(lambda: Epoch(True), repeat)
+    PrintResult(f"データローダ ({selectData}, ターゲット: {target}, {len(df)}行, ミニバッチ: {miniBatch})", baseTime, fastTime)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ベンチマーク")
+    parser.add_argument("bench", choices=["preproc", "loader"], help="計測対象")
+    parser.add_argument("--data", default="house", help="入力データ")
+    parser.add_argument("--target", default="SalePrice", help="ターゲット")
+    parser.add_argument("--miniBatch", type=int, default=32, help="ミニバッチのデータ数 (データローダのみ)")
+    parser.add_argument("--repeat", type=int, default=20, help="計測回数")
+    args = parser.parse_args()
+
+    if args.bench == "preproc":
+        BenchPreproc(args.data, args.target, args.repeat)
+    elif args.bench == "loader":
+        BenchLoader(args.data, args.target, args.miniBatch, args.repeat)
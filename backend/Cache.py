@@ -0,0 +1,261 @@
+###############################################################################
+# 機能：キャッシュ機能
+# 概要：メモリ上限・LRU破棄・有効期限・バージョン確認を備えたキャッシュを提供する。
+###############################################################################
+from collections import OrderedDict
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+
+# 生成済みのキャッシュ (メトリクス取得用)
+caches = {}
+
+
+# 機能：LRUキャッシュクラス
+# 概要：最後に参照された順にエントリを保持し、メモリ上限を超えた場合に最も古いエントリを破棄する。
+#
+# name    : キャッシュ名 (メトリクスのキー)
+# maxBytes: メモリ上限(バイト)
+# ttl     : 有効期限(秒) Noneの場合は無期限
+#
+class LruCache:
+    # コンストラクタ
+    def __init__(self, name, maxBytes, ttl=None):
+        self.name = name
+        self.maxBytes = maxBytes
+        self.ttl = ttl
+        # エントリ (キー: [値, サイズ, バージョン, 格納時刻])
+        self.entries = OrderedDict()
+        self.totalBytes = 0
+        self.lock = threading.Lock()
+        # 利用状況
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+        # メトリクス取得用に登録
+        caches[name] = self
+
+    # 取得処理
+    # キャッシュに存在しない、有効期限切れ、バージョン不一致の場合はNoneを返す
+    def Get(self, key, version=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+
+            value, _, entryVersion, storedTime = entry
+            # 有効期限切れの場合、エントリを破棄
+            if (self.ttl is not None) and (time.monotonic() - storedTime > self.ttl):
+                self.Remove(key)
+                self.stats["expirations"] += 1
+                self.stats["misses"] += 1
+                return None
+
+            # バージョンが一致しない場合(元データが更新された場合)、エントリを破棄
+            if (version is not None) and (version != entryVersion):
+                self.Remove(key)
+                self.stats["invalidations"] += 1
+                self.stats["misses"] += 1
+                return None
+
+            # 最新の参照として末尾に移動
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return value
+
+    # 格納処理
+    # サイズが指定されていない場合、値から算出する
+    def Set(self, key, value, version=None, size=None):
+        if size is None:
+            size = GetObjectSize(value)
+        with self.lock:
+            if key in self.entries:
+                self.Remove(key)
+
+            # メモリ上限を超える値は格納しない
+            if size > self.maxBytes:
+                return
+
+            self.entries[key] = [value, size, version, time.monotonic()]
+            self.totalBytes += size
+
+            # メモリ上限を超えた場合、最も古いエントリから破棄
+            while self.totalBytes > self.maxBytes:
+                oldKey = next(iter(self.entries))
+                self.Remove(oldKey)
+                self.stats["evictions"] += 1
+
+    # 無効化処理
+    # キーの条件関数が指定されている場合は該当するエントリを、指定されていない場合は全エントリを破棄する
+    def Invalidate(self, match=None):
+        with self.lock:
+            keys = [key for key in self.entries if (match is None) or match(key)]
+            for key in keys:
+                self.Remove(key)
+            self.stats["invalidations"] += len(keys)
+
+    # エントリ削除処理 (ロック取得済みの状態で呼び出す)
+    def Remove(self, key):
+        entry = self.entries.pop(key)
+        self.totalBytes -= entry[1]
+
+    # メトリクス取得処理
+    def GetMetrics(self):
+        with self.lock:
+            metrics = dict(self.stats)
+            metrics.update({"entries": len(self.entries), "bytes": self.totalBytes, "maxBytes": self.maxBytes})
+
+        requests = metrics["hits"] + metrics["misses"]
+        metrics["hitRate"] = (metrics["hits"] / requests) if requests > 0 else 0.0
+        return metrics
+
+
+# 機能：ディスクキャッシュクラス
+# 概要：JSONに変換可能な値をディレクトリ内のファイルとして保持し、プロセスの再起動後も使用できるようにする。
+#      容量の上限を超えた場合、最後に参照された時刻(ファイルの更新時刻)が最も古いエントリから破棄する。
+#      キーはファイル名として使用するため、英数字・ハイフン・アンダースコアのみとする。
+#
+# name     : キャッシュ名 (メトリクスのキー)
+# directory: 保存先ディレクトリ
+# maxBytes : 容量上限(バイト)
+#
+class DiskCache:
+    # コンストラクタ
+    def __init__(self, name, directory, maxBytes):
+        self.name = name
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.lock = threading.Lock()
+        # 利用状況
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+        # 保存済みのエントリのサイズを取得
+        os.makedirs(directory, exist_ok=True)
+        self.sizes = {}
+        for fileName in os.listdir(directory):
+            if fileName.endswith(".json"):
+                self.sizes[fileName[:-len(".json")]] = os.path.getsize(os.path.join(directory, fileName))
+        self.totalBytes = sum(self.sizes.values())
+
+        # メトリクス取得用に登録
+        caches[name] = self
+
+    # 取得処理
+    # キャッシュに存在しない場合はNoneを返す
+    def Get(self, key):
+        with self.lock:
+            path = self.GetPath(key)
+            try:
+                with open(path, encoding="utf-8") as file:
+                    value = json.load(file)
+            except (OSError, ValueError):
+                self.stats["misses"] += 1
+                return None
+
+            # 最新の参照として更新時刻を更新
+            os.utime(path)
+            self.stats["hits"] += 1
+            return value
+
+    # 格納処理
+    def Set(self, key, value):
+        data = json.dumps(value, ensure_ascii=False, allow_nan=False).encode("utf-8")
+        with self.lock:
+            # 容量上限を超える値は格納しない
+            if len(data) > self.maxBytes:
+                return
+
+            # 書き込み中のファイルが読み込まれないよう、一時ファイルに書き込んだ後に置き換える
+            fd, tempPath = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            os.replace(tempPath, self.GetPath(key))
+
+            self.totalBytes += len(data) - self.sizes.get(key, 0)
+            self.sizes[key] = len(data)
+
+            # 容量上限を超えた場合、最後に参照された時刻が最も古いエントリから破棄
+            if self.totalBytes > self.maxBytes:
+                keys = sorted(self.sizes, key=lambda oldKey: self.GetAccessTime(oldKey))
+                for oldKey in keys:
+                    if self.totalBytes <= self.maxBytes:
+                        break
+                    if oldKey != key:
+                        self.Remove(oldKey)
+                        self.stats["evictions"] += 1
+
+    # 無効化処理
+    # キーの条件関数が指定されている場合は該当するエントリを、指定されていない場合は全エントリを破棄する
+    def Invalidate(self, match=None):
+        with self.lock:
+            keys = [key for key in self.sizes if (match is None) or match(key)]
+            for key in keys:
+                self.Remove(key)
+            self.stats["invalidations"] += len(keys)
+
+    # エントリ削除処理 (ロック取得済みの状態で呼び出す)
+    def Remove(self, key):
+        self.totalBytes -= self.sizes.pop(key)
+        try:
+            os.remove(self.GetPath(key))
+        except OSError:
+            pass
+
+    # エントリのファイルパスを取得
+    def GetPath(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    # エントリの最終参照時刻を取得 (ファイルがない場合は最も古い時刻)
+    def GetAccessTime(self, key):
+        try:
+            return os.path.getmtime(self.GetPath(key))
+        except OSError:
+            return 0.0
+
+    # メトリクス取得処理
+    def GetMetrics(self):
+        with self.lock:
+            metrics = dict(self.stats)
+            metrics.update({"entries": len(self.sizes), "bytes": self.totalBytes, "maxBytes": self.maxBytes})
+
+        requests = metrics["hits"] + metrics["misses"]
+        metrics["hitRate"] = (metrics["hits"] / requests) if requests > 0 else 0.0
+        return metrics
+
+
+# 機能：オブジェクトサイズ取得処理
+# 概要：キャッシュに格納する値のおおよそのメモリ使用量(バイト)を取得する。
+def GetObjectSize(value):
+    # データフレーム
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    # シリーズ
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    # 配列
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    # タプル・リスト
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(GetObjectSize(item) for item in value)
+    # 辞書
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(GetObjectSize(item) for item in value.values())
+    # テンソル等 (要素サイズと要素数を持つ場合)
+    if hasattr(value, "element_size") and hasattr(value, "nelement"):
+        return value.element_size() * value.nelement()
+
+    return sys.getsizeof(value)
+
+
+# 機能：キャッシュメトリクス取得処理
+# 概要：生成済みの全キャッシュの利用状況を取得する。
+def GetCacheMetrics():
+    return {name: cache.GetMetrics() for name, cache in caches.items()}
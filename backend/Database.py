@@ -0,0 +1,159 @@
+###############################################################################
+# 機能：データベース接続機能
+# 概要：プロセス全体で共有するDBエンジン(コネクションプール)を管理し、
+#      プールの利用状況を提供する。
+###############################################################################
+from contextlib import contextmanager
+import os
+import threading
+import time
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+
+# DBエンジン (アプリケーション起動時に生成し、全リクエストで共有)
+engine = None
+# エンジン生成・破棄時の排他ロック
+engineLock = threading.Lock()
+
+# プール利用状況
+poolStats = {
+    "connects": 0,       # 物理接続の生成数
+    "checkouts": 0,      # 接続の払い出し数
+    "checkins": 0,       # 接続の返却数
+    "invalidates": 0,    # 無効化された接続数
+    "waitTotal": 0.0,    # 払い出し待ち時間の合計(秒)
+    "waitMax": 0.0,      # 払い出し待ち時間の最大値(秒)
+    "waitCount": 0,      # 払い出し待ち時間の計測数
+    "timeouts": 0,       # 払い出し待ちのタイムアウト数
+}
+statsLock = threading.Lock()
+
+
+# 機能：DBエンジン生成処理
+# 概要：環境変数の設定に基づき、コネクションプール付きのDBエンジンを生成する。
+#
+# DB_POOL_SIZE    : 常時保持する接続数 (既定値: 5)
+# DB_MAX_OVERFLOW : プールサイズを超えて一時的に生成できる接続数 (既定値: 10)
+# DB_POOL_TIMEOUT : 接続の払い出し待ちのタイムアウト秒数 (既定値: 30)
+# DB_POOL_RECYCLE : 接続を再生成するまでの秒数 (既定値: 1800)
+# DB_POOL_PRE_PING: 払い出し前に接続の死活確認を行うか (既定値: True)
+#
+def InitEngine():
+    global engine
+
+    with engineLock:
+        # 生成済みの場合、そのまま返す
+        if engine is not None:
+            return engine
+
+        # DB接続情報を取得
+        userName = os.getenv("DB_USERNAME")
+        password = os.getenv("DB_PASSWORD")
+        host = os.getenv("DB_HOST")
+        dbName = os.getenv("DB_NAME")
+
+        engine = create_engine(
+            f"postgresql://{userName}:{password}@{host}/{dbName}",
+            pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+            pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+            pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+            pool_pre_ping=(os.getenv("DB_POOL_PRE_PING", "True") == "True"))
+
+        # プールのイベントを登録
+        event.listen(engine, "connect", lambda *args: CountPoolEvent("connects"))
+        event.listen(engine, "checkout", lambda *args: CountPoolEvent("checkouts"))
+        event.listen(engine, "checkin", lambda *args: CountPoolEvent("checkins"))
+        event.listen(engine, "invalidate", lambda *args: CountPoolEvent("invalidates"))
+
+        return engine
+
+
+# 機能：DBエンジン取得処理
+# 概要：共有のDBエンジンを取得する。未生成の場合は生成する。
+def GetEngine():
+    if engine is None:
+        return InitEngine()
+
+    return engine
+
+
+# 機能：DBエンジン破棄処理
+# 概要：共有のDBエンジンを破棄し、プール内の接続を全て終了する。
+def DisposeEngine():
+    global engine
+
+    with engineLock:
+        if engine is not None:
+            engine.dispose()
+            engine = None
+
+
+# 機能：DB接続処理
+# 概要：共有のプールから接続を払い出し、払い出しまでの待ち時間を記録する。
+@contextmanager
+def Connect():
+    startTime = time.perf_counter()
+    try:
+        conn = GetEngine().connect()
+    except PoolTimeoutError:
+        # 払い出し待ちのタイムアウトを記録
+        CountPoolEvent("timeouts")
+        raise
+
+    # 払い出し待ち時間を記録
+    waitTime = time.perf_counter() - startTime
+    with statsLock:
+        poolStats["waitTotal"] += waitTime
+        poolStats["waitMax"] = max(poolStats["waitMax"], waitTime)
+        poolStats["waitCount"] += 1
+
+    try:
+        yield conn
+    finally:
+        # 接続をプールに返却
+        conn.close()
+
+
+# 機能：テーブルバージョン取得処理
+# 概要：テーブルの更新有無を判定するためのバージョン値を取得する。
+#      統計情報(pg_stat_user_tables)の追加・更新・削除行数を使用し、
+#      統計情報が取得できない場合は行数を使用する。
+def GetTableVersion(conn, tableName):
+    row = conn.execute(
+        text("SELECT n_tup_ins, n_tup_upd, n_tup_del, n_live_tup FROM pg_stat_user_tables WHERE relname = :tableName"),
+        {"tableName": tableName}).fetchone()
+
+    if row is not None:
+        return tuple(row)
+
+    return (conn.execute(text("SELECT COUNT(*) FROM " + tableName)).scalar(),)
+
+
+# プールのイベント数を加算
+def CountPoolEvent(key):
+    with statsLock:
+        poolStats[key] += 1
+
+
+# 機能：プール利用状況取得処理
+# 概要：コネクションプールの現在の状態および、累積の利用状況を取得する。
+def GetPoolMetrics():
+    with statsLock:
+        metrics = dict(poolStats)
+
+    # 払い出し待ち時間の平均値を算出
+    metrics["waitAvg"] = (metrics["waitTotal"] / metrics["waitCount"]) if metrics["waitCount"] > 0 else 0.0
+
+    # プールの現在の状態を取得
+    if engine is not None:
+        pool = engine.pool
+        metrics.update({
+            "size": pool.size(),
+            "checkedIn": pool.checkedin(),
+            "checkedOut": pool.checkedout(),
+            "overflow": pool.overflow()})
+
+    return metrics
@@ -2,15 +2,44 @@
 # 機能：機械学習簡易体験システム 定義ファイル
 # 概要：汎用的な処理や定義を提供する。
 ###############################################################################
+from contextlib import contextmanager
 from enum import Enum
+import hashlib
+import json
+import os
+import psutil
+import threading
+
+
+# 前処理の実装バージョン (前処理辞書以外の前処理内容を変更した場合に更新する)
+PREPROC_VERSION = 1
 
 
 # フェッチリクエスト
 class FETCH_REQ(Enum):
     Import = "Import"
+    Count = "Count"
     Preproc = "Preproc"
     Optimize = "Optimize"
     Learning = "Learning"
+    Predict = "Predict"
+
+
+# レスポンス形式
+# json: 行データのJSON (既定)  columnar: 列指向の型付き配列のJSON  arrow: Arrow IPCストリーム
+class RES_FORMAT(Enum):
+    json = "json"
+    columnar = "columnar"
+    arrow = "arrow"
+
+
+# ジョブ状態
+class JOB_STATUS(Enum):
+    queued = "queued"
+    running = "running"
+    done = "done"
+    error = "error"
+    cancelled = "cancelled"
 
 
 # 分析問題
@@ -26,6 +55,14 @@ class INPUT_DATA(Enum):
     house = "house"
 
 
+# 入力データのキー列 (ページ単位の取得時の並び順に使用)
+INPUT_DATA_KEY = {
+    INPUT_DATA.titanic.value: "PassengerId",
+    INPUT_DATA.lego.value: "SetId",
+    INPUT_DATA.house.value: "HouseId"
+}
+
+
 # モデル
 class MODEL(Enum):
     nn = "nn"
@@ -194,6 +231,13 @@ def GetPreprocDict(selectData):
         ]
         
         
+# 機能：前処理辞書バージョン取得処理
+# 概要：前処理辞書の内容および前処理の実装バージョンから、前処理のバージョン(ハッシュ値)を取得する。
+def GetPreprocDictVersion(selectData):
+    content = json.dumps([PREPROC_VERSION, GetPreprocDict(selectData)], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
 # 機能：パラメータ辞書取得処理
 # 概要：リクエストの引数から、各パラメータの辞書情報を取得する。
 def GetParamDict(reqArg, optimize):
@@ -246,6 +290,64 @@ def GetParamDict(reqArg, optimize):
     return {key: (type_conversions[key](reqArg[idx]) if key in type_conversions else reqArg[idx]) for idx, key in enumerate(keys)}
     
     
+# CPUの割り当て状況 (optimize: 実行中の最適化に割り当てたCPU数、learning: 実行中の学習数)
+cpuLock = threading.Lock()
+cpuUsage = {"optimize": 0.0, "learning": 0}
+
+
+# 機能：CPU数取得処理
+# 概要：学習・最適化で使用するCPU数(物理CPU数)を取得する。Rayのローカル起動時のCPU数と同一とする。
+def GetCpuCount():
+    return psutil.cpu_count(logical=False) or psutil.cpu_count() or 1
+
+
+# 機能：最適化CPU割り当て処理
+# 概要：最適化の実行中、最適化に割り当てたCPU数を予約し、学習実行が使用するCPU数から除く。
+@contextmanager
+def ReserveOptimizeCpus(numCpus):
+    with cpuLock:
+        cpuUsage["optimize"] += numCpus
+    try:
+        yield
+    finally:
+        with cpuLock:
+            cpuUsage["optimize"] -= numCpus
+
+
+# 機能：学習CPU割り当て処理
+# 概要：学習の実行中、実行中の学習数に加え、学習実行が使用するCPU数を実行中の学習で分割する。
+@contextmanager
+def ReserveLearningCpus():
+    with cpuLock:
+        cpuUsage["learning"] += 1
+    try:
+        yield
+    finally:
+        with cpuLock:
+            cpuUsage["learning"] -= 1
+
+
+# 機能：並列数取得処理
+# 概要：ランダムフォレストの学習の並列数(n_jobs)を、割り当てられたCPU数から取得する。
+#      最適化の試行では試行に割り当てたCPU数、学習実行では実行中の最適化に割り当てたCPU数を除いたCPU数を
+#      実行中の学習数で分割したCPU数を使用し、他の学習・試行が使用するCPUと重複しないようにする。
+#      (並列数は学習開始時の割り当て状況で決まり、学習中に開始した最適化・学習は考慮しない)
+#
+# RF_N_JOBS: 並列数の上限 (既定値: 上限なし)
+#
+def GetNumJobs(numCpus=None):
+    # CPU数が指定されていない場合(学習実行)
+    if numCpus is None:
+        with cpuLock:
+            numCpus = (GetCpuCount() - cpuUsage["optimize"]) // max(cpuUsage["learning"], 1)
+
+    numJobs = max(int(numCpus), 1)
+    if os.getenv("RF_N_JOBS"):
+        numJobs = min(numJobs, max(int(os.getenv("RF_N_JOBS")), 1))
+
+    return numJobs
+
+
 # 機能：文字列Boolean変換処理
 # 概要：文字列のTrue/FalseをBoolean型に変換する。
 def str_to_bool(val):
@@ -0,0 +1,78 @@
+###############################################################################
+# 機能：レスポンス符号化機能
+# 概要：データフレームを列指向の形式(型付き配列のJSON、Arrow IPC)に符号化する。
+###############################################################################
+import base64
+import json
+
+import numpy as np
+import pandas as pd
+
+# Arrow IPC形式はpyarrowがインストールされている場合のみ使用可能
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+# 機能：列指向JSON符号化処理
+# 概要：データフレームを列毎の型付き配列に符号化する。
+#      数値列はリトルエンディアンのバイト列をBase64で格納し(JavaScriptの型付き配列で復元可能)、
+#      それ以外の列は値のリストとして格納する(欠損値はNone)。
+#
+# 数値列  : {"name": 列名, "dtype": "float64" | "int32" | "uint8", "data": Base64文字列}
+#           float64の欠損値はNaNとして格納する。
+# その他列: {"name": 列名, "dtype": "object", "data": 値のリスト}
+#
+def EncodeColumnar(df):
+    columns = []
+    for name in df.columns:
+        col = df[name]
+
+        # 真偽値列
+        if pd.api.types.is_bool_dtype(col.dtype):
+            columns.append(EncodeArray(name, col.to_numpy(dtype=np.uint8), "uint8"))
+
+        # 整数列 (int32の範囲内の場合はint32、範囲外の場合はfloat64)
+        elif pd.api.types.is_integer_dtype(col.dtype):
+            values = col.to_numpy()
+            if (len(values) == 0) or ((values.min() >= np.iinfo(np.int32).min) and (values.max() <= np.iinfo(np.int32).max)):
+                columns.append(EncodeArray(name, values.astype("<i4"), "int32"))
+            else:
+                columns.append(EncodeArray(name, values.astype("<f8"), "float64"))
+
+        # 浮動小数点数列
+        elif pd.api.types.is_float_dtype(col.dtype):
+            columns.append(EncodeArray(name, col.to_numpy(dtype="<f8"), "float64"))
+
+        # その他の列 (欠損値にNoneを設定)
+        else:
+            values = col.astype(object).where(col.notna(), None).tolist()
+            columns.append({"name": str(name), "dtype": "object", "data": values})
+
+    return {"rows": len(df), "columns": columns}
+
+
+# 型付き配列を符号化
+def EncodeArray(name, values, dtype):
+    return {"name": str(name), "dtype": dtype, "data": base64.b64encode(np.ascontiguousarray(values).tobytes()).decode("ascii")}
+
+
+# 機能：Arrow IPC符号化処理
+# 概要：データフレームをArrow IPCストリーム形式のバイト列に符号化する。
+#      データフレーム以外のレスポンス情報は、JSON文字列としてスキーマのメタデータに格納する。
+def EncodeArrow(df, meta):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({"meta": json.dumps(meta, ensure_ascii=False)})
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+    return sink.getvalue().to_pybytes()
+
+
+# 機能：Arrow IPC使用可否取得処理
+# 概要：pyarrowがインストールされ、Arrow IPC形式が使用可能か取得する。
+def ArrowAvailable():
+    return pa is not None
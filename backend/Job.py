@@ -0,0 +1,201 @@
+###############################################################################
+# 機能：ジョブ管理機能
+# 概要：時間のかかる処理(学習・最適化)をバックグラウンドで実行し、
+#      その進捗・結果の取得およびキャンセルを提供する。
+###############################################################################
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import uuid
+
+from Define import JOB_STATUS
+
+
+# 機能：ジョブクラス
+# 概要：1件のジョブの状態・進捗・結果を保持する。
+class Job:
+    # コンストラクタ
+    def __init__(self, req):
+        self.jobId = uuid.uuid4().hex
+        self.req = req
+        self.status = JOB_STATUS.queued.value
+        # 進捗 (current: 完了数 total: 全体数 unit: 単位("epoch", "trial"など))
+        self.progress = {"current": 0, "total": 0, "unit": ""}
+        self.result = None
+        self.error = None
+        self.createdTime = time.time()
+        self.finishedTime = None
+        self.cancelEvent = threading.Event()
+        self.future = None
+        self.lock = threading.Lock()
+        # イベント (エポック毎の指標など、発生順にクライアントへ配信する情報)
+        self.events = []
+        self.eventCond = threading.Condition()
+        # 非同期のイベント待ち (イベントループ、通知用イベント)
+        self.asyncWaiters = set()
+
+    # 進捗更新処理
+    def Progress(self, current, total, unit):
+        with self.lock:
+            self.progress = {"current": current, "total": total, "unit": unit}
+
+    # イベント発行処理
+    def Publish(self, event, data):
+        with self.eventCond:
+            self.events.append({"id": len(self.events), "event": event, "data": data})
+            self.eventCond.notify_all()
+            asyncWaiters = list(self.asyncWaiters)
+
+        # 非同期のイベント待ちには、各イベントループ上で通知
+        for loop, notify in asyncWaiters:
+            try:
+                loop.call_soon_threadsafe(notify.set)
+            except RuntimeError:
+                pass
+
+    # イベント待ち処理
+    # 指定位置以降のイベントを返す。イベントがない場合はジョブ終了またはタイムアウトまで待つ
+    def WaitEvents(self, start, timeout):
+        with self.eventCond:
+            if (len(self.events) <= start) and (not self.Finished()):
+                self.eventCond.wait(timeout)
+            return self.events[start:]
+
+    # イベント待ち処理 (非同期)
+    # イベント待ち処理と同一だが、待機中はスレッドを占有しない
+    async def WaitEventsAsync(self, start, timeout):
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self.eventCond:
+            if (len(self.events) > start) or self.Finished():
+                return self.events[start:]
+            self.asyncWaiters.add(waiter)
+
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self.eventCond:
+                self.asyncWaiters.discard(waiter)
+
+        with self.eventCond:
+            return self.events[start:]
+
+    # 終了有無取得処理
+    def Finished(self):
+        return self.status in (JOB_STATUS.done.value, JOB_STATUS.error.value, JOB_STATUS.cancelled.value)
+
+    # キャンセル要求有無取得処理
+    def Cancelled(self):
+        return self.cancelEvent.is_set()
+
+    # 状態取得処理
+    def GetStatus(self):
+        with self.lock:
+            return {"jobId": self.jobId, "req": self.req, "status": self.status, "progress": dict(self.progress),
+                    "error": self.error, "createdTime": self.createdTime, "finishedTime": self.finishedTime}
+
+
+# 機能：ジョブ管理クラス
+# 概要：ジョブを上限付きのスレッドプールで実行し、ジョブの一覧を管理する。
+#
+# maxWorkers: 同時に実行するジョブ数
+# maxQueue  : 実行待ちを含めて受け付けるジョブ数の上限
+# ttl       : 終了したジョブを保持する秒数
+#
+class JobManager:
+    # コンストラクタ
+    def __init__(self, maxWorkers, maxQueue, ttl):
+        self.executor = ThreadPoolExecutor(max_workers=maxWorkers, thread_name_prefix="job")
+        self.maxQueue = maxQueue
+        self.ttl = ttl
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    # 投入処理
+    # 処理関数はジョブを引数に取り、レスポンスを返す。受付上限を超えた場合はNoneを返す
+    def Submit(self, req, func):
+        self.Cleanup()
+
+        with self.lock:
+            active = [job for job in self.jobs.values()
+                      if job.status in (JOB_STATUS.queued.value, JOB_STATUS.running.value)]
+            if len(active) >= self.maxQueue:
+                return None
+
+            job = Job(req)
+            self.jobs[job.jobId] = job
+            job.future = self.executor.submit(self.Run, job, func)
+
+        return job
+
+    # 実行処理
+    def Run(self, job, func):
+        with job.lock:
+            # 実行前にキャンセルされた場合
+            if job.Cancelled():
+                return
+            job.status = JOB_STATUS.running.value
+
+        try:
+            result = func(job)
+            status = JOB_STATUS.cancelled.value if job.Cancelled() else JOB_STATUS.done.value
+            error = None
+        except Exception as errMsg:
+            result = None
+            status = JOB_STATUS.cancelled.value if job.Cancelled() else JOB_STATUS.error.value
+            error = str(errMsg)
+
+        # 状態更新と終了イベントの発行は、イベント待ち側から見て同時に行う
+        with job.eventCond:
+            with job.lock:
+                job.result = result if status == JOB_STATUS.done.value else None
+                job.status = status
+                job.error = error
+                job.finishedTime = time.time()
+
+            # 終了イベントを発行
+            job.Publish("end", {"status": status, "error": error})
+
+    # 取得処理
+    def Get(self, jobId):
+        with self.lock:
+            return self.jobs.get(jobId)
+
+    # キャンセル処理
+    # 実行待ちの場合は即時にキャンセルし、実行中の場合は処理側にキャンセルを要求する
+    def Cancel(self, jobId):
+        job = self.Get(jobId)
+        if job is None:
+            return None
+
+        job.cancelEvent.set()
+        with job.eventCond:
+            with job.lock:
+                queued = (job.status == JOB_STATUS.queued.value)
+                if queued:
+                    job.future.cancel()
+                    job.status = JOB_STATUS.cancelled.value
+                    job.finishedTime = time.time()
+
+            if queued:
+                job.Publish("end", {"status": JOB_STATUS.cancelled.value, "error": None})
+
+        return job
+
+    # 終了済みジョブの破棄処理
+    def Cleanup(self):
+        now = time.time()
+        with self.lock:
+            expired = [jobId for jobId, job in self.jobs.items()
+                       if (job.finishedTime is not None) and (now - job.finishedTime > self.ttl)]
+            for jobId in expired:
+                del self.jobs[jobId]
+
+    # 終了処理
+    def Shutdown(self):
+        with self.lock:
+            for job in self.jobs.values():
+                job.cancelEvent.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
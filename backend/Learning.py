@@ -4,7 +4,9 @@
 ###############################################################################
 import math
 import numpy as np
+import os
 import psutil
+import warnings
 
 import pytorch_lightning as pl
 from pytorch_lightning import Trainer
@@ -13,38 +15,104 @@ from pytorch_lightning.callbacks import EarlyStopping
 from sklearn.ensemble import RandomForestRegressor, RandomForestClassifier
 from sklearn.metrics import mean_squared_error, log_loss, accuracy_score, precision_score, recall_score, f1_score
 from sklearn.model_selection import train_test_split
-from sklearn.neighbors import KNeighborsRegressor, KNeighborsClassifier
+from sklearn.neighbors import KNeighborsRegressor, KNeighborsClassifier, NearestNeighbors
 from sklearn.svm import SVR, SVC
 
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from torch.utils.data import DataLoader, TensorDataset, random_split
-from torchmetrics import Accuracy, Precision, Recall, F1Score
+from torch.utils.data import DataLoader, Subset, TensorDataset, random_split
 
-from Define import PROBLEM, MODEL, GetProblem
+from Cache import LruCache
+from Define import PROBLEM, MODEL, GetProblem, GetNumJobs
+from Encode import EncodeArray
+from Model import SaveModel, LoadModel
+
+
+# 分割データのキャッシュ (キー: データキー、ターゲット、分割方法)
+# データキーは前処理データを一意に識別する値(テーブル名、前処理辞書のバージョン、テーブルのバージョン)
+# SPLIT_CACHE_MB : メモリ上限(MB) (既定値: 256)
+# SPLIT_CACHE_TTL: 有効期限(秒) (既定値: 600)
+splitCache = LruCache("split", int(os.getenv("SPLIT_CACHE_MB", "256")) * 1024 * 1024,
+                      float(os.getenv("SPLIT_CACHE_TTL", "600")))
+
+# k近傍法の近傍探索結果のキャッシュ (キー: データキー、ターゲット、距離尺度)
+# NEIGHBOR_CACHE_MB: メモリ上限(MB) (既定値: 64)
+# 有効期限は分割データのキャッシュと同一とする
+neighborCache = LruCache("neighbor", int(os.getenv("NEIGHBOR_CACHE_MB", "64")) * 1024 * 1024,
+                         float(os.getenv("SPLIT_CACHE_TTL", "600")))
+
+# k近傍法の最適化の探索範囲 (近傍数、距離尺度)
+# 距離尺度毎に最大の近傍数で近傍探索を1回行い、各試行で共有する
+KNN_NEIGHBORS = [3, 5, 7, 10]
+KNN_METRICS = ["euclidean", "manhattan", "chebyshev"]
+# k近傍法の近傍探索で取得する近傍数 (最適化の探索範囲の近傍数の最大値)
+KNN_MAX_K = max(KNN_NEIGHBORS)
+
+# 分割方法 (種類、検証・テストデータの割合、乱数シード)
+SPLIT_NN = ("nn", 0.2, 0)
+SPLIT_TRDT = ("trdt", 0.3, 0)
+
+# データローダのワーカを使用せず、メインプロセスでミニバッチを生成する最大行数
+# DATALOADER_INPROC_ROWS: 最大行数 (既定値: 100000)
+DATALOADER_INPROC_ROWS = int(os.getenv("DATALOADER_INPROC_ROWS", "100000"))
+
+# ニューラルネットワークの学習エンジン (lightning: Lightningのトレーナ、simple: 簡易学習エンジン)
+# NN_ENGINE: 学習エンジン (既定値: lightning)
+NN_ENGINE = os.getenv("NN_ENGINE", "lightning")
 
 
 # 機能：ニューラルネットワーク 学習実行処理
 # 概要：ニューラルネットワークによる学習を行う。
-def ExecLearning_Nn(df, paramDict):
+#      ジョブが指定されている場合、エポック毎の進捗をジョブに記録する。
+#      データキーが指定されている場合、分割データをキャッシュする。
+#      簡易形式が指定されている場合、ターゲット予測値／正解値を型付き配列として返す。
+#      モデルキーが指定されている場合、学習済みモデルを前処理状態と併せて保存する。
+def ExecLearning_Nn(df, paramDict, job=None, dataKey=None, compact=False, modelKey=None, preproc=None):
     # 分析問題取得処理
     problem, uniqueNum = GetProblem(df, paramDict["target"])
     # データローダ取得処理
-    numFeatures, trainLoader, valLoader, testLoader = GetDataloader(df, problem, paramDict["target"], paramDict["miniBatch"])
+    numFeatures, trainLoader, valLoader, testLoader = GetDataloader(df, problem, paramDict["target"], paramDict["miniBatch"],
+                                                                    dataKey=dataKey)
     
     # ニューラルネットワークのモデル定義
     model = Net(numFeatures, paramDict, problem, uniqueNum)
-    # Early Stopping設定
-    earlyStopCallback = EarlyStopping(monitor="val_loss", min_delta=0.0, patience=5, verbose=True, mode="min")
+    # ジョブが指定されている場合、検証データのエポック毎の指標をイベントとして発行
+    if job is not None:
+        model.epochListener = lambda epochResult: job.Publish("epoch", epochResult)
+    
+    # 簡易学習エンジンの場合
+    if NN_ENGINE == "simple":
+        trainer = SimpleTrainer(paramDict["epoch"] - 1, patience=5, job=job)
+        
+    # Lightningのトレーナの場合
+    else:
+        # Early Stopping設定
+        earlyStopCallback = EarlyStopping(monitor="val_loss", min_delta=0.0, patience=5, verbose=True, mode="min")
+        
+        # ジョブ進捗コールバック設定
+        callbacks = [earlyStopCallback]
+        if job is not None:
+            callbacks.append(JobCallback(job))
+        
+        trainer = Trainer(callbacks=callbacks, max_epochs=(paramDict["epoch"] - 1), log_every_n_steps=len(trainLoader))
     
     # 学習実行
-    trainer = Trainer(callbacks=[earlyStopCallback], max_epochs=(paramDict["epoch"] - 1), log_every_n_steps=len(trainLoader))
     trainer.fit(model, trainLoader, valLoader)
     
+    # ジョブがキャンセルされた場合、テストを行わずに終了
+    if (job is not None) and job.Cancelled():
+        return []
+    
     # テスト実行
     trainer.test(model, testLoader)
     
+    # 学習済みモデルを保存
+    if modelKey is not None:
+        info = GetModelInfo(df, paramDict, problem, uniqueNum, preproc)
+        info["numFeatures"] = numFeatures
+        SaveModel(modelKey, {"info": info, "stateDict": model.state_dict()}, True)
+    
     # 検証データおよびテストデータのエポック毎の指標を取得
     valMetrics = model.metrics["val"]["epoch"]
     testMetrics = model.metrics["test"]["epoch"]
@@ -56,10 +124,7 @@ def ExecLearning_Nn(df, paramDict):
     # 回帰問題の場合
     if problem == PROBLEM.regression:        
         # 損失値および、ターゲット予測値／正解値を返す
-        yPred = [round(pred, 2) for pred in model.yPred]
-        yTest = [round(test, 2) for test in model.yTest]
-        
-        return [valLosses, [], [testLoss], [yPred, yTest]]
+        return [valLosses, [], [testLoss], GetPredResult(model.yPred, model.yTest, problem, compact)]
     
     # 分類問題の場合
     else:
@@ -78,41 +143,262 @@ def ExecLearning_Nn(df, paramDict):
         return [valLosses,
                 [valAccMax, valPrecMax, valRecMax, valF1Max],
                 [testLoss, testAcc, testPrec, testRec, testF1],
-                [model.yPred, model.yTest]]
+                GetPredResult(model.yPred, model.yTest, problem, compact)]
     
     
+# 機能：ジョブ進捗コールバッククラス
+# 概要：エポック毎の進捗をジョブに記録し、キャンセルが要求された場合は学習を停止する。
+class JobCallback(pl.Callback):
+    # コンストラクタ
+    def __init__(self, job):
+        super().__init__()
+        self.job = job
+
+    # 訓練エポック終了処理
+    def on_train_epoch_end(self, trainer, pl_module):
+        self.job.Progress(trainer.current_epoch + 1, trainer.max_epochs, "epoch")
+
+    # 訓練ステップ終了処理
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx):
+        if self.job.Cancelled():
+            trainer.should_stop = True
+
+
+# 機能：簡易学習エンジンクラス
+# 概要：Lightningのトレーナを使用せず、ニューラルネットワーククラスの順伝播・損失値・最適化アルゴリズムで学習・テストを行う。
+#      ロガー・チェックポイント・進捗表示などを省き、1回の学習の処理時間とメモリ使用量を削減する。
+#      指標の算出順序はトレーナと同一とする(学習前の検証データ2ステップでの動作確認、検証後の訓練エポック処理)。
+#
+# maxEpochs: 最大エポック数
+# patience : 検証データの損失値が改善しない場合に学習を終了するまでのエポック数 (Early Stopping)
+# job      : ジョブ (指定されている場合、エポック毎の進捗を記録し、キャンセルが要求された場合は学習を停止)
+#
+class SimpleTrainer:
+    # 学習前の動作確認(サニティチェック)のステップ数
+    SANITY_STEPS = 2
+
+    # コンストラクタ
+    def __init__(self, maxEpochs, patience=5, job=None):
+        self.maxEpochs = maxEpochs
+        self.patience = patience
+        self.job = job
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    # 学習処理
+    def fit(self, model, trainLoader, valLoader):
+        model.useTrainer = False
+        model.to(self.device)
+        optimizer = model.configure_optimizers()
+
+        # 動作確認 (トレーナと同様に、検証データの指標に含める)
+        self.Evaluate(model, valLoader, "val", self.SANITY_STEPS)
+
+        bestLoss = math.inf
+        waitCount = 0
+        for epoch in range(self.maxEpochs):
+            # 訓練
+            model.train()
+            for batch in trainLoader:
+                loss = model.ProcStep(self.ToDevice(batch), "train")
+                optimizer.zero_grad()
+                loss.backward()
+                optimizer.step()
+
+                # キャンセルが要求された場合、学習を停止
+                if (self.job is not None) and self.job.Cancelled():
+                    return
+
+            # 検証
+            self.Evaluate(model, valLoader, "val")
+            model.ProcEpoch("train")
+            if self.job is not None:
+                self.job.Progress(epoch + 1, self.maxEpochs, "epoch")
+
+            # Early Stopping (損失値が異常値の場合、または改善しないエポック数が上限に達した場合に終了)
+            valLoss = model.metrics["val"]["epoch"]["losses"][-1]
+            if not math.isfinite(valLoss):
+                return
+            if valLoss < bestLoss:
+                bestLoss = valLoss
+                waitCount = 0
+            else:
+                waitCount += 1
+                if waitCount >= self.patience:
+                    return
+
+    # テスト処理
+    def test(self, model, testLoader):
+        model.useTrainer = False
+        model.to(self.device)
+        self.Evaluate(model, testLoader, "test")
+
+    # 評価処理 (最大ステップ数が指定されている場合、そのステップ数のみ処理)
+    def Evaluate(self, model, loader, learnPhase, maxSteps=None):
+        model.eval()
+        with torch.inference_mode():
+            for step, batch in enumerate(loader):
+                if (maxSteps is not None) and (step >= maxSteps):
+                    break
+                model.ProcStep(self.ToDevice(batch), learnPhase)
+            model.ProcEpoch(learnPhase)
+
+    # ミニバッチをデバイスに転送
+    def ToDevice(self, batch):
+        return [data.to(self.device) for data in batch]
+
+
 # 機能：データローダ取得処理
 # 概要：データローダを取得する。
-def GetDataloader(df, problem, target, miniBatch):
+#      ワーカ数が指定されていない場合、CPU数とGPU数の半数とする。
+#      データキーが指定されている場合、分割データをキャッシュする。
+def GetDataloader(df, problem, target, miniBatch, numWorkers=None, dataKey=None):
+    # 分割データ取得処理
+    split = GetSplit_Nn(df, problem, target, dataKey)
+
+    # データローダを返す
+    return GetDataloaderSplit(split, miniBatch, numWorkers)
+
+
+# 機能：テンソル用配列取得処理
+# 概要：データフレームから、テンソルの元となる入力データ・ターゲットデータの配列を取得する。
+def GetTensorArray(df, problem, target):
     # 入力データを取得
-    x = torch.tensor(df.drop(columns=[target]).values, dtype=torch.float32)
+    x = df.drop(columns=[target]).to_numpy(dtype=np.float32)
     # ターゲットデータを取得
     if problem == PROBLEM.regression:
-        t = torch.tensor(df[target].values, dtype=torch.float32)
+        t = df[target].to_numpy(dtype=np.float32)
     else:
-        t = torch.tensor(df[target].values, dtype=torch.int64)
+        t = df[target].to_numpy(dtype=np.int64)
+
+    return x, t
+
+
+# 機能：分割データ取得処理 (ニューラルネットワーク)
+# 概要：入力データ・ターゲットデータの連続した配列と、訓練データ・検証データ・テストデータの位置を取得する。
+#      分割後の乱数の状態も保持し、キャッシュを使用した場合も以降の処理(重みの初期値など)を同一にする。
+#      データキーが指定されている場合、同一のデータ・ターゲット・分割方法の結果はキャッシュから取得する。
+def GetSplit_Nn(df, problem, target, dataKey=None):
+    cacheKey = (dataKey, target, SPLIT_NN)
+    if dataKey is not None:
+        split = splitCache.Get(cacheKey)
+        if split is not None:
+            return split
+
+    # 入力データおよびターゲットデータを取得
+    x, t = GetTensorArray(df, problem, target)
+
+    # 訓練データ・検証データ・テストデータに分割
+    _, ratio, seed = SPLIT_NN
+    torch.manual_seed(seed)
+    valTestSize = math.floor(len(x) * ratio)
+    train, val, test = random_split(range(len(x)), [len(x) - (valTestSize * 2), valTestSize, valTestSize])
+
+    split = {"x": x, "t": t,
+             "train": np.asarray(train.indices, dtype=np.int64),
+             "val": np.asarray(val.indices, dtype=np.int64),
+             "test": np.asarray(test.indices, dtype=np.int64),
+             "rngState": torch.get_rng_state().numpy()}
+
+    if dataKey is not None:
+        splitCache.Set(cacheKey, split)
+
+    return split
+
+
+# 機能：データローダ取得処理 (分割データ)
+# 概要：分割データからデータローダを取得する。
+#      配列はコピーせずにテンソルとして参照する(Rayのオブジェクトストア上の読み取り専用の配列も可)。
+#      メインプロセスでの生成有無が指定されていない場合、ワーカを使用しない場合または
+#      行数がDATALOADER_INPROC_ROWS以下の場合に、メインプロセスでミニバッチを生成する。
+def GetDataloaderSplit(split, miniBatch, numWorkers=None, inProcess=None):
+    # 配列を共有したままテンソルに変換 (読み取り専用の配列に対する警告は抑止。テンソルは変更しない)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)
+        x = torch.from_numpy(split["x"])
+        t = torch.from_numpy(split["t"])
     # データセットを取得
     dataset = TensorDataset(x, t)
     # 入力データから特徴数を取得
     numFeatures = x.shape[1]
+
+    # メインプロセスでの生成有無
+    if inProcess is None:
+        inProcess = (numWorkers == 0) or (len(x) <= DATALOADER_INPROC_ROWS)
+
+    # メインプロセスでミニバッチを生成する場合
+    if inProcess:
+        trainLoader = TensorBatchLoader(x, t, split["train"], miniBatch, shuffle=True, dropLast=True)
+        valLoader = TensorBatchLoader(x, t, split["val"], miniBatch)
+        testLoader = TensorBatchLoader(x, t, split["test"], miniBatch)
+        # 乱数の状態を分割直後の状態に設定
+        torch.set_rng_state(torch.from_numpy(split["rngState"].copy()))
+
+        return numFeatures, trainLoader, valLoader, testLoader
     
     # データセットを訓練データ・検証データ・テストデータに分割
-    torch.manual_seed(0)
-    valTestSize = math.floor(len(dataset) * 0.2)
-    train, val, test = random_split(dataset, [len(dataset) - (valTestSize * 2), valTestSize, valTestSize])
+    train = Subset(dataset, split["train"].tolist())
+    val = Subset(dataset, split["val"].tolist())
+    test = Subset(dataset, split["test"].tolist())
+    # 乱数の状態を分割直後の状態に設定
+    torch.set_rng_state(torch.from_numpy(split["rngState"].copy()))
 
     # CPU数とGPU数の半数を取得
-    num_workers = round((psutil.cpu_count(logical=False) + torch.cuda.device_count()) / 2 + 0.1)
+    if numWorkers is None:
+        num_workers = round((psutil.cpu_count(logical=False) + torch.cuda.device_count()) / 2 + 0.1)
+    else:
+        num_workers = numWorkers
+    # ワーカを使用する場合のみ、ワーカを維持
+    persistent_workers = (num_workers > 0)
 
     # データローダを取得
-    trainLoader = DataLoader(train, miniBatch, shuffle=True, drop_last=True, num_workers=num_workers, persistent_workers=True)
-    valLoader = DataLoader(val, miniBatch, num_workers=num_workers, persistent_workers=True)
-    testLoader = DataLoader(test, miniBatch, num_workers=num_workers, persistent_workers=True)
+    trainLoader = DataLoader(train, miniBatch, shuffle=True, drop_last=True, num_workers=num_workers, persistent_workers=persistent_workers)
+    valLoader = DataLoader(val, miniBatch, num_workers=num_workers, persistent_workers=persistent_workers)
+    testLoader = DataLoader(test, miniBatch, num_workers=num_workers, persistent_workers=persistent_workers)
     
     # 特徴数およびデータローダを返す
     return numFeatures, trainLoader, valLoader, testLoader
 
 
+# 機能：テンソルミニバッチ生成クラス
+# 概要：メモリ上のテンソルから、メインプロセスでミニバッチを生成する。
+#      ワーカの起動やプロセス間通信を行わず、位置の配列の分割(シャッフル時は並べ替え後の分割)でミニバッチを取得する。
+#      テンソルは複製せずに参照のみを保持し(試行間で共有する配列を試行毎に複製しない)、ミニバッチ毎に該当位置のデータを取得する。
+#
+# x, t      : 入力データ・ターゲットデータのテンソル
+# indices   : 対象とするデータの位置
+# miniBatch : ミニバッチのデータ数
+# shuffle   : エポック毎にデータを並べ替えるか
+# dropLast  : データ数がミニバッチに満たない最後のミニバッチを除くか
+#
+class TensorBatchLoader:
+    # コンストラクタ
+    def __init__(self, x, t, indices, miniBatch, shuffle=False, dropLast=False):
+        # 対象のデータの位置と、元のテンソルの参照を保持
+        self.indices = torch.from_numpy(np.asarray(indices, dtype=np.int64))
+        self.x = x
+        self.t = t
+        self.miniBatch = miniBatch
+        self.shuffle = shuffle
+        self.dropLast = dropLast
+
+    # ミニバッチ数
+    def __len__(self):
+        if self.dropLast:
+            return len(self.indices) // self.miniBatch
+        return math.ceil(len(self.indices) / self.miniBatch)
+
+    # ミニバッチ生成
+    def __iter__(self):
+        dataNum = len(self.indices)
+        end = (dataNum // self.miniBatch) * self.miniBatch if self.dropLast else dataNum
+
+        # シャッフルする場合は並べ替えた位置、シャッフルしない場合は位置の順にミニバッチを取得
+        indices = self.indices[torch.randperm(dataNum)] if self.shuffle else self.indices
+        for start in range(0, end, self.miniBatch):
+            batchIdx = indices[start:start + self.miniBatch]
+            yield self.x[batchIdx], self.t[batchIdx]
+
+
 # 機能：ニューラルネットワーククラス
 # 概要：ニューラルネットワークのモデル定義クラス。
 class Net(pl.LightningModule):
@@ -175,28 +461,20 @@ class Net(pl.LightningModule):
         self.optimizer = paramDict["optimizer"]
         self.lr = paramDict["lr"]
         # ターゲット予測値／正解値の格納先を定義
-        self.yPred = []
-        self.yTest = []
-        
-        # 分類問題の指標算出関数を設定
-        # 2値分類
-        if uniqueNum == 2:
-            self.acc = Accuracy(task="binary")
-            self.precision = Precision(task="binary", average="macro")
-            self.recall = Recall(task="binary", average="macro")
-            self.f1score = F1Score(task="binary", average="macro")
-            
-        # 多クラス分類
-        elif uniqueNum > 2:
-            self.acc = Accuracy(task="multiclass", num_classes=uniqueNum)
-            self.precision = Precision(task="multiclass", num_classes=uniqueNum, average="macro")
-            self.recall = Recall(task="multiclass", num_classes=uniqueNum, average="macro")
-            self.f1score = F1Score(task="multiclass", num_classes=uniqueNum, average="macro")
+        # テスト中はステップ毎のテンソルをデバイス上に保持し、テスト終了時に一括で連結する
+        self.yPred = None
+        self.yTest = None
+        self.yPredSteps = []
+        self.yTestSteps = []
         
         # 指標辞書取得処理
-        self.metrics = GetMetricsDict()
+        self.metrics = GetMetricsDict(uniqueNum)
         # 分類数を保持
         self.uniqueNum = uniqueNum
+        # 検証データのエポック毎の指標の通知先
+        self.epochListener = None
+        # Lightningのトレーナで学習するか (簡易学習エンジンの場合はFalse)
+        self.useTrainer = True
 
     # 二乗平均平方根誤差(RMSE)算出処理
     def RMSE(self, y_pred, y_true):
@@ -220,75 +498,60 @@ class Net(pl.LightningModule):
         
         # 損失値を算出
         loss = self.lf(yPred, yTest)
-        # ステップ毎の損失値を保存
-        metrics = self.metrics[learnPhase]["step"]
-        metrics["losses"].append(loss)
-        
-        # 分類問題の場合、各指標を算出
-        if self.uniqueNum >= 2:
-            # 2値分類
-            if self.uniqueNum == 2:
-                yPredArgmax = torch.argmax(yPred, axis=1)
-                acc = self.acc(yPredArgmax, yTest)
-                prec = self.precision(yPredArgmax, yTest)
-                rec = self.recall(yPredArgmax, yTest)
-                f1 = self.f1score(yPredArgmax, yTest)
-            
-            # 多クラス分類
-            else:
-                acc = self.acc(yPred, yTest)
-                prec = self.precision(yPred, yTest)
-                rec = self.recall(yPred, yTest)
-                f1 = self.f1score(yPred, yTest)
-        
-            # 各指標を保存
-            metrics["accs"].append(acc)
-            metrics["precs"].append(prec)
-            metrics["recs"].append(rec)
-            metrics["f1s"].append(f1)
+        # 当エポックの集計値を更新 (分類問題の場合、混同行列も更新)
+        self.metrics[learnPhase]["step"].Update(loss, yPred, yTest)
             
         # テスト中の場合、ターゲット予測値／正解値を保存
         if learnPhase == "test":
-            self.yTest.extend(yTest.tolist())
-            # 回帰問題の予測値
+            self.yTestSteps.append(yTest.detach())
+            # 回帰問題の予測値 (ミニバッチの全データ)
             if self.uniqueNum < 2:
-                self.yPred.extend(yPred.tolist()[0])
+                self.yPredSteps.append(yPred.detach().reshape(-1))
             # 分類問題の予測値
             else:
-                yPredArgmax = torch.argmax(yPred, axis=1)
-                self.yPred.extend(yPredArgmax.tolist())
+                self.yPredSteps.append(torch.argmax(yPred.detach(), axis=1))
         
         # モデル最適化のため損失値を返す
         return loss
     
     # エポック処理
     def ProcEpoch(self, learnPhase):
-        # 当エポックの損失値の平均値を算出
+        # 当エポックの損失値の平均値および各指標を算出
         stepMetrics = self.metrics[learnPhase]["step"]
-        avg_loss = torch.stack(stepMetrics["losses"]).mean()
+        epochResult = stepMetrics.Compute()
         
         # エポック毎の損失値を保存
         epochMetrics = self.metrics[learnPhase]["epoch"]
-        epochMetrics["losses"].append(avg_loss.item())
+        epochMetrics["losses"].append(epochResult["loss"])
         
-        # 検証中の場合、損失値を記録
-        if learnPhase == "val":
-            self.log("val_loss", avg_loss.item())
+        # 検証中の場合、損失値を記録 (Lightningのトレーナで学習する場合のみ)
+        if (learnPhase == "val") and self.useTrainer:
+            self.log("val_loss", epochResult["loss"])
         
-        # 分類問題の場合、各指標を算出し記録
+        # 分類問題の場合、各指標を記録
         if self.uniqueNum >= 2:
-            avg_acc = torch.stack(stepMetrics["accs"]).mean()
-            avg_prec = torch.stack(stepMetrics["precs"]).mean()
-            avg_rec = torch.stack(stepMetrics["recs"]).mean()
-            avg_f1 = torch.stack(stepMetrics["f1s"]).mean()
-
-            epochMetrics["accs"].append(avg_acc.item())
-            epochMetrics["precs"].append(avg_prec.item())
-            epochMetrics["recs"].append(avg_rec.item())
-            epochMetrics["f1s"].append(avg_f1.item())
+            epochMetrics["accs"].append(epochResult["acc"])
+            epochMetrics["precs"].append(epochResult["prec"])
+            epochMetrics["recs"].append(epochResult["rec"])
+            epochMetrics["f1s"].append(epochResult["f1"])
+        
+        # 検証中かつ通知先が設定されている場合、当エポックの指標を通知
+        if (learnPhase == "val") and (self.epochListener is not None):
+            epochResult = {"epoch": len(epochMetrics["losses"]), "loss": epochMetrics["losses"][-1]}
+            if self.uniqueNum >= 2:
+                epochResult.update({"acc": epochMetrics["accs"][-1], "prec": epochMetrics["precs"][-1],
+                                    "rec": epochMetrics["recs"][-1], "f1": epochMetrics["f1s"][-1]})
+            self.epochListener(epochResult)
         
-        # ステップ毎の指標格納辞書をクリア
-        stepMetrics = GetMetricsDict_Main()
+        # 当エポックの集計値をクリア
+        stepMetrics.Reset()
+        
+        # テスト中の場合、ターゲット予測値／正解値を連結し、配列として保持
+        if (learnPhase == "test") and (len(self.yTestSteps) > 0):
+            self.yPred = torch.cat(self.yPredSteps).cpu().numpy()
+            self.yTest = torch.cat(self.yTestSteps).cpu().numpy()
+            self.yPredSteps = []
+            self.yTestSteps = []
                  
     # 訓練ステップ処理
     def training_step(self, batch, batch_idx):
@@ -336,18 +599,18 @@ class Net(pl.LightningModule):
 
 # 機能：指標辞書取得処理
 # 概要：各学習フェーズにおける、指標の格納辞書を取得する。
-def GetMetricsDict():
+def GetMetricsDict(uniqueNum):
     return {
-        "train": GetMetricsDict_Steps(),
-        "val": GetMetricsDict_Steps(),
-        "test": GetMetricsDict_Steps()
+        "train": GetMetricsDict_Steps(uniqueNum),
+        "val": GetMetricsDict_Steps(uniqueNum),
+        "test": GetMetricsDict_Steps(uniqueNum)
     }
 
 
-# ステップおよびエポック毎の指標
-def GetMetricsDict_Steps():
+# 当エポックの集計値およびエポック毎の指標
+def GetMetricsDict_Steps(uniqueNum):
     return {
-        "step": GetMetricsDict_Main(),
+        "step": EpochAccumulator(uniqueNum),
         "epoch": GetMetricsDict_Main()
     }
 
@@ -357,11 +620,102 @@ def GetMetricsDict_Main():
     return {"losses": [], "accs": [], "precs": [], "recs": [], "f1s": []}
 
 
+# 機能：エポック集計クラス
+# 概要：ステップ毎の損失値の合計と、分類問題の混同行列(正解値×予測値の件数)をデバイス上で集計する。
+#      ステップ毎の値は保持しないため、メモリ使用量はエポックの長さによらず一定。
+#      デバイスからの値の取得は、エポック終了時の算出処理でのみ行う。
+#
+# 損失値  : ステップ毎の損失値の平均値
+# 各指標  : エポック全体の混同行列から算出
+#           2値分類  : 正解率、クラス1の適合率・再現率・F値
+#           多クラス分類: 正解率(全データに対する正解数の割合)、
+#                        適合率・再現率・F値のクラス毎の値のマクロ平均
+#                        (正解・予測のいずれにも現れないクラスは除く)
+#
+class EpochAccumulator:
+    # コンストラクタ
+    def __init__(self, uniqueNum):
+        self.uniqueNum = uniqueNum
+        self.Reset()
+
+    # 集計値クリア処理
+    def Reset(self):
+        self.lossSum = None
+        self.steps = 0
+        self.confusion = None
+
+    # 集計値更新処理
+    def Update(self, loss, yPred, yTest):
+        loss = loss.detach()
+        self.lossSum = loss if self.lossSum is None else self.lossSum + loss
+        self.steps += 1
+
+        # 分類問題の場合、混同行列を更新
+        if self.uniqueNum >= 2:
+            classNum = self.uniqueNum
+            yPredArgmax = torch.argmax(yPred.detach(), axis=1)
+            counts = torch.bincount(yTest * classNum + yPredArgmax, minlength=classNum * classNum)
+            counts = counts.view(classNum, classNum)
+            self.confusion = counts if self.confusion is None else self.confusion + counts
+
+    # 算出処理
+    def Compute(self):
+        if self.steps <= 0:
+            result = {"loss": math.nan}
+            if self.uniqueNum >= 2:
+                result.update({"acc": 0.0, "prec": 0.0, "rec": 0.0, "f1": 0.0})
+            return result
+
+        values = [self.lossSum / self.steps]
+
+        # 分類問題の場合、混同行列から各指標を算出
+        if self.uniqueNum >= 2:
+            confusion = self.confusion.double()
+            tp = confusion.diag()
+            fp = confusion.sum(axis=0) - tp
+            fn = confusion.sum(axis=1) - tp
+
+            # 正解率 (torchmetricsのAccuracyの既定値(micro)と同一)
+            acc = tp.sum() / confusion.sum()
+
+            # 2値分類 (クラス1を陽性とする)
+            if self.uniqueNum == 2:
+                tp, fp, fn = tp[1], fp[1], fn[1]
+                prec = SafeDivide(tp, tp + fp)
+                rec = SafeDivide(tp, tp + fn)
+                f1 = SafeDivide(2 * tp, 2 * tp + fp + fn)
+
+            # 多クラス分類 (マクロ平均)
+            else:
+                weights = ((tp + fp + fn) > 0).double()
+                weightSum = weights.sum().clamp(min=1)
+                prec = (SafeDivide(tp, tp + fp) * weights).sum() / weightSum
+                rec = (SafeDivide(tp, tp + fn) * weights).sum() / weightSum
+                f1 = (SafeDivide(2 * tp, 2 * tp + fp + fn) * weights).sum() / weightSum
+
+            values.extend([acc, prec, rec, f1])
+
+        # デバイスから一括で取得
+        values = torch.stack([value.double() for value in values]).tolist()
+        result = {"loss": values[0]}
+        if self.uniqueNum >= 2:
+            result.update({"acc": values[1], "prec": values[2], "rec": values[3], "f1": values[4]})
+        return result
+
+
+# 分母が0の場合に0とする除算
+def SafeDivide(num, den):
+    return torch.where(den > 0, num / den.clamp(min=1e-12), torch.zeros_like(num))
+
+
 # 機能：従来モデル 学習実行処理
 # 概要：従来モデルによる学習を行う。
-def ExecLearning_Trdt(df, paramDict):
+#      データキーが指定されている場合、分割データをキャッシュする。
+#      簡易形式が指定されている場合、ターゲット予測値／正解値を型付き配列として返す。
+#      モデルキーが指定されている場合、学習済みモデルを前処理状態と併せて保存する。
+def ExecLearning_Trdt(df, paramDict, dataKey=None, compact=False, modelKey=None, preproc=None):
     # 分析問題取得処理
-    problem, _ = GetProblem(df, paramDict["target"])
+    problem, uniqueNum = GetProblem(df, paramDict["target"])
 
     # ランダムフォレスト
     if paramDict["model"] == MODEL.rf.value:
@@ -380,12 +734,12 @@ def ExecLearning_Trdt(df, paramDict):
         if problem == PROBLEM.regression:
             model = RandomForestRegressor(n_estimators=paramDict["nEstimators"], max_features=maxFeatures,
                                           max_depth=maxDepth, min_samples_split=paramDict["minSamplesSplit"],
-                                          random_state=0)
+                                          n_jobs=GetNumJobs(), random_state=0)
         # 分類問題のモデル定義
         else:
             model = RandomForestClassifier(n_estimators=paramDict["nEstimators"], max_features=maxFeatures,
                                            max_depth=maxDepth, min_samples_split=paramDict["minSamplesSplit"],
-                                           random_state=0)
+                                           n_jobs=GetNumJobs(), random_state=0)
     # サポートベクターマシン
     elif paramDict["model"] == MODEL.svm.value:
         if paramDict["gamma"] == 0:
@@ -407,39 +761,101 @@ def ExecLearning_Trdt(df, paramDict):
             model = KNeighborsClassifier(n_neighbors=paramDict["nNeighbors"], weights=paramDict["weights"],
                                          algorithm=paramDict["algorithm"], metric=paramDict["metric"])
     
+    # 予測処理 (指標は保存するモデルと同一の学習済みモデルで算出)
+    metrics = Predict(df, paramDict["target"], model, problem, dataKey, compact)
+    
+    # 学習済みモデルを保存
+    if modelKey is not None:
+        SaveModel(modelKey, {"info": GetModelInfo(df, paramDict, problem, uniqueNum, preproc), "model": model}, False)
+    
     # 予測処理の結果を返す
-    return Predict(df, paramDict["target"], model, problem)
+    return metrics
 
 
 # 機能：予測処理
 # 概要：モデルの学習とターゲットの予測を行う。
-def Predict(df, target, model, problem):
+def Predict(df, target, model, problem, dataKey=None, compact=False):
+    # 分割データ取得処理
+    split = GetSplit_Trdt(df, target, dataKey)
+
+    # 予測処理の結果を返す
+    return PredictSplit(split, model, problem, compact)
+
+
+# 機能：分割データ取得処理 (従来モデル)
+# 概要：入力データ・ターゲットデータの配列と、訓練データ・テストデータの位置を取得する。
+#      データキーが指定されている場合、同一のデータ・ターゲット・分割方法の結果はキャッシュから取得する。
+def GetSplit_Trdt(df, target, dataKey=None):
+    cacheKey = (dataKey, target, SPLIT_TRDT)
+    if dataKey is not None:
+        split = splitCache.Get(cacheKey)
+        if split is not None:
+            return split
+
     # 入力データを取得
     x = df.drop(columns=[target]).values
     # ターゲットデータを取得
     y = df[target].values
-    # 訓練データとテストデータに分割
-    xTrain, xTest, yTrain, yTest = train_test_split(x, y, test_size=0.3, random_state=0)
+    # 訓練データとテストデータに分割 (配列を直接分割した場合と同一の位置)
+    _, ratio, seed = SPLIT_TRDT
+    trainIdx, testIdx = train_test_split(np.arange(len(x)), test_size=ratio, random_state=seed)
+
+    split = {"x": x, "t": y, "train": trainIdx, "test": testIdx}
+
+    if dataKey is not None:
+        splitCache.Set(cacheKey, split)
+
+    return split
+
+
+# 機能：予測処理 (分割データ)
+# 概要：分割データから、モデルの学習とターゲットの予測を行う。
+def PredictSplit(split, model, problem, compact=False):
+    # 訓練データとテストデータを取得
+    x, y = split["x"], split["t"]
+    xTrain, xTest = x[split["train"]], x[split["test"]]
+    yTrain, yTest = y[split["train"]], y[split["test"]]
     
+    # 予測処理の結果を返す
+    return FitPredict(model, xTrain, yTrain, xTest, yTest, problem, compact)
+
+
+# 機能：学習・予測処理
+# 概要：訓練データでモデルを学習し、テストデータのターゲットを予測して各指標を算出する。
+#      入力データは、カーネル行列を事前に算出したサポートベクターマシンの場合はカーネル行列とする。
+def FitPredict(model, xTrain, yTrain, xTest, yTest, problem, compact=False):
     # 学習実行
     model.fit(xTrain, yTrain)
     
     # 回帰問題の場合
     if problem == PROBLEM.regression:
         # 予測実行
-        yPred = model.predict(xTest)
+        return GetPredMetrics(model.predict(xTest), yTest, problem, compact)
         
+    # 分類問題の場合
+    else:
+        # 予測実行 (確率の校正を行わないサポートベクターマシンの場合、決定関数の値から確率を算出)
+        if getattr(model, "probability", True):
+            yProba = model.predict_proba(xTest)
+        else:
+            yProba = GetDecisionProba(model.decision_function(xTest))
+        
+        return GetPredMetrics(yProba, yTest, problem, compact)
+
+
+# 機能：指標算出処理
+# 概要：ターゲット予測値(分類問題の場合はクラス毎の確率)とターゲット正解値から、各指標を算出する。
+def GetPredMetrics(yPred, yTest, problem, compact=False):
+    # 回帰問題の場合
+    if problem == PROBLEM.regression:
         # 損失値および、ターゲット予測値／正解値を返す
         loss = round(math.sqrt(mean_squared_error(yTest, yPred)), 2)
-        yPredRes = [round(pred, 2) for pred in yPred.tolist()]
-        yTestRes = [round(test, 2) for test in yTest.tolist()]
         
-        return [[loss], [yPredRes, yTestRes]]
+        return [[loss], GetPredResult(yPred, yTest, problem, compact)]
         
     # 分類問題の場合
     else:
-        # 予測実行
-        yProba = model.predict_proba(xTest)
+        yProba = yPred
         
         # 各指標を算出
         loss = round(log_loss(yTest, yProba, labels=list(range(yProba.shape[1]))), 2)
@@ -451,4 +867,167 @@ def Predict(df, target, model, problem):
         f1 = round(f1_score(yTest, yProbaArgmax, average="macro", zero_division=0.0) * 100)
         
         # 各指標および、ターゲット予測値／正解値を返す
-        return [[loss, acc, prec, rec, f1], [yProbaArgmax.tolist(), yTest.tolist()]]
+        return [[loss, acc, prec, rec, f1], GetPredResult(yProbaArgmax, yTest, problem, compact)]
+
+
+# 機能：近傍探索処理
+# 概要：テストデータの各データについて、訓練データから距離の近い順に指定数の近傍(距離と位置)を探索する。
+#      近傍数・重み・アルゴリズムは探索結果に影響しないため(近傍数は先頭からの切り出しで対応)、
+#      同一のデータ・ターゲット・距離尺度の探索結果を共有できる。
+#      同距離の近傍の選択がアルゴリズムにより異なり得るため、最適化の試行のみで使用し、学習実行では使用しない。
+#      データキーが指定されている場合、探索結果をキャッシュし、キャッシュの近傍数が不足する場合のみ再探索する。
+def GetNeighbors(split, target, metric, maxK=KNN_MAX_K, dataKey=None):
+    cacheKey = (dataKey, target, metric)
+    if dataKey is not None:
+        neighbors = neighborCache.Get(cacheKey)
+        if (neighbors is not None) and (neighbors["ind"].shape[1] >= maxK):
+            return neighbors
+
+    # 訓練データに対して、テストデータの近傍を探索
+    x = split["x"]
+    nearest = NearestNeighbors(n_neighbors=maxK, metric=metric).fit(x[split["train"]])
+    dist, ind = nearest.kneighbors(x[split["test"]])
+
+    neighbors = {"dist": dist, "ind": ind}
+
+    if dataKey is not None:
+        neighborCache.Set(cacheKey, neighbors)
+
+    return neighbors
+
+
+# 機能：予測処理 (近傍探索結果)
+# 概要：近傍探索結果の先頭から近傍数分の近傍を使用し、k近傍法のモデルと同一の方法でターゲットを予測して各指標を算出する。
+#      重みがdistanceの場合は距離の逆数で重み付けし、距離が0の近傍がある場合はその近傍のみを使用する。
+def PredictNeighbors(split, neighbors, nNeighbors, weights, problem, compact=False):
+    # 訓練データとテストデータのターゲットを取得
+    y = split["t"]
+    yTrain, yTest = y[split["train"]], y[split["test"]]
+
+    # 近傍の距離とターゲットを取得
+    dist = neighbors["dist"][:, :nNeighbors]
+    yNeighbor = yTrain[neighbors["ind"][:, :nNeighbors]]
+
+    # 近傍の重みを算出
+    if weights == "distance":
+        with np.errstate(divide="ignore"):
+            weight = 1.0 / dist
+        infMask = np.isinf(weight)
+        infRow = np.any(infMask, axis=1)
+        weight[infRow] = infMask[infRow]
+    else:
+        weight = np.ones_like(dist)
+
+    # 回帰問題の場合 (重み付き平均値)
+    if problem == PROBLEM.regression:
+        yPred = np.sum(yNeighbor * weight, axis=1) / np.sum(weight, axis=1)
+
+        return GetPredMetrics(yPred, yTest, problem, compact)
+
+    # 分類問題の場合 (訓練データに含まれるクラス毎の重みの合計の割合)
+    else:
+        classes = np.unique(yTrain)
+        neighborClass = np.searchsorted(classes, yNeighbor)
+        yProba = np.zeros((len(yNeighbor), len(classes)))
+        for classIdx in range(len(classes)):
+            yProba[:, classIdx] = np.sum(weight * (neighborClass == classIdx), axis=1)
+
+        normalizer = np.sum(yProba, axis=1, keepdims=True)
+        normalizer[normalizer == 0.0] = 1.0
+        yProba /= normalizer
+
+        return GetPredMetrics(yProba, yTest, problem, compact)
+
+
+# 機能：決定関数確率変換処理
+# 概要：サポートベクターマシンの決定関数の値を確率に変換する。
+#      確率の校正(Platt scaling)の交差検証を行わないため校正はされないが、クラスの順位は予測結果と一致する。
+#      2値分類はシグモイド関数、多クラス分類はソフトマックス関数で変換する。
+def GetDecisionProba(decision):
+    # 2値分類
+    if decision.ndim == 1:
+        proba = 1 / (1 + np.exp(-decision))
+        return np.column_stack([1 - proba, proba])
+
+    # 多クラス分類
+    decision = decision - decision.max(axis=1, keepdims=True)
+    proba = np.exp(decision)
+    return proba / proba.sum(axis=1, keepdims=True)
+
+
+# 機能：予測結果取得処理
+# 概要：ターゲット予測値／正解値の配列を、レスポンス用に一括で変換する。
+#      回帰問題は小数第2位に丸めた浮動小数点数、分類問題は整数とする。
+#      簡易形式が指定されている場合、型付き配列(リトルエンディアンのバイト列をBase64で格納)として返す。
+def GetPredResult(yPred, yTest, problem, compact=False):
+    # 回帰問題
+    if problem == PROBLEM.regression:
+        dtype, npType = "float64", "<f8"
+        yPred = np.round(np.asarray(yPred, dtype=np.float64), 2)
+        yTest = np.round(np.asarray(yTest, dtype=np.float64), 2)
+    # 分類問題
+    else:
+        dtype, npType = "int32", "<i4"
+        yPred = np.asarray(yPred)
+        yTest = np.asarray(yTest)
+
+    if compact:
+        return [EncodeArray("yPred", yPred.astype(npType), dtype), EncodeArray("yTest", yTest.astype(npType), dtype)]
+
+    return [yPred.tolist(), yTest.tolist()]
+
+
+# 機能：モデル情報取得処理
+# 概要：学習済みモデルと併せて保存する情報(学習時の特徴量の列名・順序、分析問題、前処理状態など)を取得する。
+#      予測時は、前処理状態で前処理したデータをこの列名・順序に揃えてから予測する。
+def GetModelInfo(df, paramDict, problem, uniqueNum, preproc=None):
+    return {"model": paramDict["model"], "target": paramDict["target"],
+            "features": [str(col) for col in df.columns if col != paramDict["target"]],
+            "regression": (problem == PROBLEM.regression), "uniqueNum": int(uniqueNum), "paramDict": dict(paramDict),
+            "preproc": preproc}
+
+
+# 機能：モデル構築処理
+# 概要：読み込んだ学習済みモデルの情報から、予測可能な状態のモデルを構築する。
+#      ニューラルネットワークは、保存したパラメータをモデル定義に設定する。
+def BuildModel(payload):
+    info = payload["info"]
+    if "stateDict" not in payload:
+        return {"info": info, "model": payload["model"]}
+
+    problem = PROBLEM.regression if info["regression"] else PROBLEM.classification
+    model = Net(info["numFeatures"], info["paramDict"], problem, info["uniqueNum"])
+    model.load_state_dict(payload["stateDict"])
+    model.eval()
+
+    return {"info": info, "model": model}
+
+
+# 機能：予測用モデル読み込み処理
+# 概要：学習済みモデルを読み込み、予測可能な状態で返す。学習済みモデルがない場合はNoneを返す。
+def LoadPredictModel(modelKey):
+    return LoadModel(modelKey, BuildModel)
+
+
+# 機能：モデル予測処理
+# 概要：読み込んだ学習済みモデルで、前処理済みのデータのターゲットを予測する。
+#      学習時の列のみを学習時の順序で使用する(学習時にない列は0とする)。
+def PredictModel(loaded, df):
+    info, model = loaded["info"], loaded["model"]
+    x = df.reindex(columns=info["features"], fill_value=0)
+
+    # ニューラルネットワーク
+    if isinstance(model, Net):
+        with torch.inference_mode():
+            yPred = model(torch.from_numpy(x.to_numpy(dtype=np.float32)))
+        yPred = yPred.reshape(-1).numpy() if info["regression"] else torch.argmax(yPred, axis=1).numpy()
+
+    # 従来モデル
+    else:
+        x = x.to_numpy(dtype=np.float64)
+        yPred = model.predict(x) if info["regression"] else np.argmax(model.predict_proba(x), axis=1)
+
+    # 回帰問題は小数第2位に丸めて返す
+    if info["regression"]:
+        return np.round(yPred.astype(np.float64), 2).tolist()
+    return yPred.astype(np.int64).tolist()
@@ -0,0 +1,143 @@
+###############################################################################
+# 機能：モデル管理機能
+# 概要：学習済みモデルをファイルに保存し、予測時に読み込む。
+#      読み込んだモデルはLRUキャッシュに保持し、同じモデルによる予測ではファイルを読み込まない。
+#      保存先の容量の上限を超えた場合、最後に使用された時刻(ファイルの更新時刻)が最も古いモデルから削除する。
+###############################################################################
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import joblib
+import torch
+
+from Cache import LruCache
+
+
+# 学習済みモデルの保存先ディレクトリ
+# MODEL_DIR   : 保存先ディレクトリ (既定値: ./models)
+# MODEL_DIR_MB: 容量上限(MB) (既定値: 1024)
+MODEL_DIR = os.getenv("MODEL_DIR", "./models")
+MODEL_DIR_BYTES = int(os.getenv("MODEL_DIR_MB", "1024")) * 1024 * 1024
+# 保存・削除時の排他ロック
+modelLock = threading.Lock()
+
+# 読み込んだモデルのキャッシュ (キー: モデルキー)
+# MODEL_CACHE_MB: メモリ上限(MB) (既定値: 256)
+modelCache = LruCache("model", int(os.getenv("MODEL_CACHE_MB", "256")) * 1024 * 1024)
+
+
+# 機能：モデルキー取得処理
+# 概要：データキー(テーブル名、前処理辞書のバージョン、テーブルのバージョン)とパラメータ辞書から、モデルキーを取得する。
+#      同一のデータ・ターゲット・パラメータで学習したモデルは、同一のモデルキーとなる。
+def GetModelKey(dataKey, paramDict):
+    keySource = json.dumps([list(dataKey), paramDict], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(keySource.encode("utf-8")).hexdigest()
+
+
+# 機能：モデル保存処理
+# 概要：学習済みモデルの情報をファイルに保存する。
+#      ニューラルネットワークはtorch形式(パラメータのみ)、従来モデルはjoblib形式で保存する。
+#      保存中のファイルが読み込まれないよう、一時ファイルに書き込んだ後に置き換える。
+def SaveModel(modelKey, payload, isTorch):
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    path = GetModelPath(modelKey, isTorch)
+
+    fd, tempPath = tempfile.mkstemp(dir=MODEL_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            if isTorch:
+                torch.save(payload, file)
+            else:
+                joblib.dump(payload, file)
+        with modelLock:
+            os.replace(tempPath, path)
+    except Exception:
+        os.remove(tempPath)
+        raise
+
+    # 再学習したモデルの場合、読み込み済みのモデルを破棄
+    modelCache.Invalidate(lambda key: key == modelKey)
+
+    # 容量上限を超えた場合、古いモデルを削除
+    EvictModels(modelKey)
+
+
+# 機能：モデル削除処理
+# 概要：保存先のモデルファイルの合計サイズが容量上限を超えた場合、更新時刻が最も古いモデルから削除する。
+#      指定されたモデル(保存直後のモデル)は削除しない。
+def EvictModels(keepKey):
+    with modelLock:
+        entries = []
+        for fileName in os.listdir(MODEL_DIR):
+            modelKey, ext = os.path.splitext(fileName)
+            if ext not in (".pt", ".joblib"):
+                continue
+            try:
+                stat = os.stat(os.path.join(MODEL_DIR, fileName))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, modelKey, fileName))
+
+        totalBytes = sum(entry[1] for entry in entries)
+        for _, size, modelKey, fileName in sorted(entries):
+            if totalBytes <= MODEL_DIR_BYTES:
+                break
+            if modelKey == keepKey:
+                continue
+            try:
+                os.remove(os.path.join(MODEL_DIR, fileName))
+            except OSError:
+                continue
+            totalBytes -= size
+            modelCache.Invalidate(lambda key: key == modelKey)
+
+
+# 機能：モデル読み込み処理
+# 概要：学習済みモデルを読み込み、構築処理で予測可能な状態にしたモデルを返す。保存されていない場合はNoneを返す。
+#      構築済みのモデルはキャッシュに保持し、2回目以降はファイルを読み込まない。
+def LoadModel(modelKey, build):
+    model = modelCache.Get(modelKey)
+    if model is not None:
+        TouchModel(modelKey)
+        return model
+
+    for isTorch in (True, False):
+        path = GetModelPath(modelKey, isTorch)
+        if not os.path.exists(path):
+            continue
+
+        if isTorch:
+            payload = torch.load(path, map_location="cpu")
+        else:
+            payload = joblib.load(path)
+
+        # キャッシュのサイズはファイルサイズで代用
+        model = build(payload)
+        modelCache.Set(modelKey, model, size=os.path.getsize(path))
+        TouchModel(modelKey)
+        return model
+
+    return None
+
+
+# 機能：モデル有無取得処理
+# 概要：学習済みモデルが保存されているか取得する。
+def ModelExists(modelKey):
+    return any(os.path.exists(GetModelPath(modelKey, isTorch)) for isTorch in (True, False))
+
+
+# 最新の使用としてモデルファイルの更新時刻を更新 (削除済みの場合は何もしない)
+def TouchModel(modelKey):
+    for isTorch in (True, False):
+        try:
+            os.utime(GetModelPath(modelKey, isTorch))
+        except OSError:
+            pass
+
+
+# モデルファイルのパスを取得
+def GetModelPath(modelKey, isTorch):
+    return os.path.join(MODEL_DIR, modelKey + (".pt" if isTorch else ".joblib"))
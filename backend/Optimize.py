@@ -2,28 +2,148 @@
 # 機能：最適化機能
 # 概要：モデルのハイパーパラメータ等の設定を最適化する。
 ###############################################################################
-import psutil
+import hashlib
+import itertools
+import joblib
+import json
+import math
+import multiprocessing
+import numpy as np
+import os
+import tempfile
+import threading
+import time
 import torch
+import uuid
+import warnings
 
+import optuna
+import pytorch_lightning as pl
 from pytorch_lightning import Trainer
 from pytorch_lightning.callbacks import EarlyStopping
 
 import ray
 from ray import tune
+from ray.train import Checkpoint, CheckpointConfig
+from ray.tune import Callback
 from ray.tune.schedulers import ASHAScheduler
+from ray.tune.search.sample import Categorical
+from ray.tune.stopper import CombinedStopper, Stopper
 from ray.tune.search.optuna import OptunaSearch
 
+# Optunaのジャーナル形式のファイルストレージ (Optuna 4.0以降はJournalFileBackend)
+try:
+    from optuna.storages.journal import JournalFileBackend
+except ImportError:
+    from optuna.storages import JournalFileStorage as JournalFileBackend
+
 from sklearn.ensemble import RandomForestRegressor, RandomForestClassifier
-from sklearn.neighbors import KNeighborsRegressor, KNeighborsClassifier
 from sklearn.svm import SVR, SVC
 
-from Define import PROBLEM, MODEL, GetProblem
-from Learning import GetDataloader, Net, Predict
+from Define import PROBLEM, MODEL, GetProblem, GetNumJobs, GetCpuCount, ReserveOptimizeCpus
+from Learning import GetSplit_Nn, GetSplit_Trdt, GetDataloaderSplit, Net, PredictSplit, FitPredict, GetNeighbors, PredictNeighbors, KNN_NEIGHBORS, KNN_METRICS, KNN_MAX_K
+
+
+# Ray初期化・終了時の排他ロック
+rayLock = threading.Lock()
+
+# 最適化の同時実行数の制限
+# 各最適化は、CPU・GPU(全組み合わせ評価はローカルのCPU、Optunaによる試行はRayクラスタのCPU・GPU)を同時実行数で等分した範囲で実行する
+# OPTIMIZE_CONCURRENCY: 最適化の同時実行数 (既定値: 2)
+optimizeConcurrency = max(int(os.getenv("OPTIMIZE_CONCURRENCY", "2")), 1)
+optimizeSemaphore = threading.BoundedSemaphore(optimizeConcurrency)
+
+# サポートベクターマシンの最適化で、試行間で共有するカーネル行列の算出元の行列のメモリ上限(MB)
+# 上限を超える場合は共有せず、試行毎にカーネルを算出する
+# SVM_KERNEL_MB: メモリ上限(MB) (既定値: 512)
+SVM_KERNEL_MB = int(os.getenv("SVM_KERNEL_MB", "512"))
+# サポートベクターマシンの分類問題の確率の算出方法
+# (platt: 交差検証による確率の校正(従来)、decision: 決定関数の値から算出(校正なし、学習1回))
+# decisionの場合、校正していない確率の損失値は決定関数のスケール(Cに依存)で変わるため、誤分類率(%)で試行を評価する
+# SVM_PROBABILITY: 算出方法 (既定値: platt)
+SVM_PROBABILITY = os.getenv("SVM_PROBABILITY", "platt")
+
+# 探索範囲が全て候補値の選択である従来モデルで、組み合わせ数が上限以下の場合は、
+# Optunaによる試行を行わず、全組み合わせを並列に評価する
+# 最大試行数・最大実行時間で途中までしか評価しない場合に探索範囲が偏らないよう、評価順は固定シードでシャッフルする
+# OPTIMIZE_GRID     : 全組み合わせ評価の使用有無 (既定値: True)
+# OPTIMIZE_GRID_MAX : 全組み合わせ評価を行う最大組み合わせ数 (既定値: 100)
+# OPTIMIZE_GRID_SEED: 全組み合わせの評価順のシャッフルに使用するシード (既定値: 0)
+OPTIMIZE_GRID_MAX = int(os.getenv("OPTIMIZE_GRID_MAX", "100"))
+OPTIMIZE_GRID_SEED = int(os.getenv("OPTIMIZE_GRID_SEED", "0"))
+
+# 最適化の予算の既定値 (リクエストで指定されていない場合に使用)
+# OPTIMIZE_MAX_TRIALS : 最大試行数 (既定値: 50)
+# OPTIMIZE_MAX_SECONDS: 最大実行時間(秒) (既定値: なし)
+OPTIMIZE_MAX_TRIALS = int(os.getenv("OPTIMIZE_MAX_TRIALS", "50"))
+OPTIMIZE_MAX_SECONDS = float(os.getenv("OPTIMIZE_MAX_SECONDS")) if os.getenv("OPTIMIZE_MAX_SECONDS") else None
+
+# Optunaの試行履歴(スタディ)の保存先
+# 同一のデータ・ターゲット・モデル・探索範囲の最適化は、保存済みの試行履歴から再開する
+# OPTIMIZE_STUDY    : 試行履歴の保存有無 (既定値: True)
+# OPTIMIZE_STUDY_DIR: 保存先ディレクトリ (既定値: ./cache/study)
+OPTIMIZE_STUDY_DIR = os.getenv("OPTIMIZE_STUDY_DIR", "./cache/study")
+
+
+# 機能：Ray初期化処理
+# 概要：アプリケーション全体で共有するRayランタイムを初期化する。初期化済みの場合は何もしない。
+#
+# RAY_ADDRESS: 接続する既存のRayクラスタのアドレス (未指定の場合、ローカルにRayを起動)
+#
+def InitRay():
+    with rayLock:
+        if ray.is_initialized():
+            return
+
+        # 既存のRayクラスタに接続
+        address = os.getenv("RAY_ADDRESS")
+        if address:
+            ray.init(address=address, logging_level="INFO", log_to_driver=True, logging_format="text")
+
+        # ローカルにRayを起動 (CPU数・GPU数を取得)
+        else:
+            num_cpus = GetCpuCount()
+            num_gpus = torch.cuda.device_count()
+            ray.init(num_cpus=num_cpus, num_gpus=num_gpus, logging_level="INFO", log_to_driver=True, logging_format="text")
+
+
+# 機能：Ray終了処理
+# 概要：共有のRayランタイムを終了する。
+def ShutdownRay():
+    with rayLock:
+        if ray.is_initialized():
+            ray.shutdown()
+
+
+# 機能：最適化リソース取得処理
+# 概要：1件の最適化が使用できるCPU数・GPU数(クラスタ全体を同時実行数で等分した値)を取得する。
+#      全組み合わせ評価はローカルで実行するため、ローカルのCPU数を同時実行数で等分した値を使用する(GetGridCpus)。
+def GetOptimizeResources():
+    resources = ray.cluster_resources()
+    num_cpus = max(resources.get("CPU", 1) / optimizeConcurrency, 1)
+    num_gpus = resources.get("GPU", 0) / optimizeConcurrency
+    return num_cpus, num_gpus
+
+
+# 機能：全組み合わせ評価CPU数取得処理
+# 概要：1件の全組み合わせ評価が使用できるCPU数(ローカルの物理コア数を同時実行数で等分した値)を取得する。
+#      Rayクラスタに接続している場合も、全組み合わせ評価はローカルのワーカープロセスで実行する。
+def GetGridCpus():
+    return max(GetCpuCount() // optimizeConcurrency, 1)
 
 
 # 機能：最適化処理
 # 概要：指定されたモデルの最適化を行う。
-def Optimize(df, paramDict):
+#      ジョブが指定されている場合、試行毎の進捗をジョブに記録する。
+#      データキーが指定されている場合、分割データをキャッシュし、Optunaの試行履歴を保存・再利用する。
+#      最大試行数・最大実行時間・目標損失値のいずれかに達した場合、最適化を終了してそれまでの最良スコアの設定を返す。
+#      最良スコアの設定と、予算の使用量(予算使用量取得処理を参照)を返す。
+#
+# maxTrials : 最大試行数 (未指定の場合はOPTIMIZE_MAX_TRIALS)
+# maxSeconds: 最大実行時間(秒) 同時実行数の制限による待ち時間は含まない (未指定の場合はOPTIMIZE_MAX_SECONDS)
+# targetLoss: 目標損失値 (いずれかの試行の損失値が目標損失値以下になった場合に終了)
+#
+def Optimize(df, paramDict, job=None, dataKey=None, maxTrials=None, maxSeconds=None, targetLoss=None):
     # 各パラメータの候補値を設定
     config = {}
     # ニューラルネットワーク
@@ -67,46 +187,471 @@ def Optimize(df, paramDict):
     # k近傍法
     else:
         # 近傍数
-        config.update({"n_neighbors": tune.choice([3, 5, 7, 10])})
+        config.update({"n_neighbors": tune.choice(KNN_NEIGHBORS)})
         # 重み
         config.update({"weights": tune.choice(["uniform", "distance"])})
-        # アルゴリズム
-        config.update({"algorithm": tune.choice(["auto", "ball_tree", "kd_tree", "brute"])})
         # 距離尺度
-        config.update({"metric": tune.choice(["euclidean", "manhattan", "chebyshev"])})
+        config.update({"metric": tune.choice(KNN_METRICS)})
             
-    # 学習関数を設定
-    if paramDict["model"] == MODEL.nn.value:
-        learningFunc = lambda config: LearningFunc_Nn(config, df, paramDict)
+    # 試行数・実行時間の上限
+    numSamples = max(int(maxTrials), 1) if maxTrials is not None else OPTIMIZE_MAX_TRIALS
+    maxSeconds = maxSeconds if maxSeconds is not None else OPTIMIZE_MAX_SECONDS
+    
+    # 保存済みの試行履歴を取得 (完了した試行数が試行数に達している場合は、最良スコアの設定を返す)
+    studyName, storage = GetStudyStorage(config, paramDict, dataKey)
+    if storage is not None:
+        studyBest = GetStudyBestConfig(studyName, storage, numSamples)
+        if studyBest is not None:
+            return GetResultConfig(studyBest[0], paramDict["model"]), GetBudgetUsed(0, numSamples, 0.0, maxSeconds, studyBest[1], targetLoss)
+    
+    # 探索範囲の組み合わせ数が少ない従来モデルの場合は全組み合わせをローカルで評価し、それ以外の場合のみRayを使用
+    gridConfigs = GetGridConfigs(config, paramDict["model"])
+    if gridConfigs is None:
+        # 共有のRayランタイムを初期化 (初期化済みの場合は何もしない)
+        InitRay()
+    
+    # ジョブ進捗コールバックおよび停止条件(キャンセル時、目標損失値に達した時)を設定
+    callbacks = [JobTuneCallback(job, numSamples)] if job is not None else None
+    stoppers = []
+    if job is not None:
+        stoppers.append(JobStopper(job))
+    if targetLoss is not None:
+        stoppers.append(TargetLossStopper(targetLoss))
+    stopper = CombinedStopper(*stoppers) if len(stoppers) > 1 else (stoppers[0] if stoppers else None)
+    
+    # 最適化実行 (同時実行数の上限に達している場合は、他の最適化の終了を待つ)
+    with optimizeSemaphore:
+        # 実行時間の計測開始
+        startTime = time.monotonic()
         
-    else:
-        learningFunc = lambda config: LearningFunc_Trdt(config, df, paramDict)
+        # 全組み合わせ評価 (ローカルのCPU数を同時実行数で等分したCPU数を予約し、学習実行で使用しないようにする)
+        # (最大試行数は、リクエストで指定された場合のみ評価する設定数の上限とし、シャッフル済みの先頭から評価する)
+        if gridConfigs is not None:
+            num_cpus = GetGridCpus()
+            with ReserveOptimizeCpus(num_cpus):
+                if maxTrials is not None:
+                    gridConfigs = gridConfigs[:numSamples]
+                study = GetGridStudy(studyName, storage, config)
+                bestConfig, bestLoss, trials = OptimizeGrid(gridConfigs, df, paramDict, dataKey, num_cpus, job,
+                                                            startTime, maxSeconds, targetLoss, study)
+                return GetResultConfig(bestConfig, paramDict["model"]), GetBudgetUsed(trials, len(gridConfigs), time.monotonic() - startTime, maxSeconds,
+                                                 bestLoss, targetLoss)
+        
+        # 1件の最適化が使用できるCPU数・GPU数から、1試行あたりのリソースおよび同時実行試行数を取得
+        num_cpus, num_gpus = GetOptimizeResources()
+        
+        # ローカルのRayで実行する場合、最適化に割り当てたCPU数を予約し、学習実行で使用しないようにする
+        with ReserveOptimizeCpus(0 if os.getenv("RAY_ADDRESS") else num_cpus):
+            trialResources, maxConcurrentTrials = GetTrialResources(paramDict["model"], num_cpus, num_gpus)
+            
+            # 学習関数を設定 (1試行に割り当てたCPU数を並列数とする)
+            learningFunc = GetLearningFunc(GetTrialData(df, paramDict, dataKey), paramDict, trialResources["cpu"])
+            
+            # リクエスト毎に個別の実験として実行
+            analysis = tune.run(
+                learningFunc, config=config, num_samples=numSamples,
+                resources_per_trial=trialResources, max_concurrent_trials=maxConcurrentTrials,
+                scheduler=ASHAScheduler(metric="loss", mode="min", max_t=50, grace_period=5, reduction_factor=2),
+                search_alg=OptunaSearch(metric="loss", mode="min", study_name=studyName, storage=storage),
+                callbacks=callbacks, stop=stopper, time_budget_s=maxSeconds,
+                checkpoint_config=CheckpointConfig(num_to_keep=1),
+                name=f"optimize_{paramDict['model']}_{uuid.uuid4().hex[:8]}")
+            
+            seconds = time.monotonic() - startTime
+    
+    # 最良スコアの試行を取得 (損失値を記録した試行がない場合はNone)
+    best_trial = analysis.get_best_trial(metric="loss", mode="min")
+    best_config = best_trial.config if best_trial is not None else None
+    best_loss = best_trial.last_result["loss"] if best_trial is not None else None
+    # 損失値を記録した試行数
+    trials = sum(1 for trial in analysis.trials if "loss" in trial.last_result)
+    
+    # 最良スコアの設定および、予算の使用量を返す
+    return GetResultConfig(best_config, paramDict["model"]), GetBudgetUsed(trials, numSamples, seconds, maxSeconds,
+                                                                           best_loss, targetLoss)
+
+
+# 機能：最適化結果設定取得処理
+# 概要：最良スコアの設定に、探索しないパラメータの値を追加する。
+#      k近傍法のアルゴリズムは、近傍探索結果を共有するため結果に影響せず、既定値(auto)とする。
+def GetResultConfig(bestConfig, model):
+    if (bestConfig is not None) and (model == MODEL.knn.value):
+        return dict(bestConfig, algorithm="auto")
+    return bestConfig
+
+
+# 機能：予算使用量取得処理
+# 概要：最適化で使用した予算(試行数・実行時間)と、最良スコアの損失値・目標損失値への到達有無を取得する。
+#      保存済みの試行履歴から最良スコアの設定を返した場合、試行数・実行時間は0とする。
+def GetBudgetUsed(trials, maxTrials, seconds, maxSeconds, loss, targetLoss):
+    return {"trials": trials, "maxTrials": maxTrials, "seconds": round(seconds, 2), "maxSeconds": maxSeconds,
+            "loss": loss, "targetLoss": targetLoss,
+            "targetReached": (targetLoss is not None) and (loss is not None) and (loss <= targetLoss)}
+
+
+# 機能：試行履歴ストレージ取得処理
+# 概要：データキー・ターゲット・モデル・探索範囲から、Optunaのスタディ名と保存先のストレージを取得する。
+#      同一のデータ(前処理辞書・テーブルのバージョンを含む)・ターゲット・モデル・探索範囲は、同一のスタディとなる。
+#      試行履歴を保存しない場合や、データキーが指定されていない場合は(None, None)を返す。
+def GetStudyStorage(config, paramDict, dataKey=None):
+    if (os.getenv("OPTIMIZE_STUDY", "True") != "True") or (dataKey is None):
+        return None, None
+
+    # 探索範囲 (候補値または範囲・刻み幅)
+    space = {}
+    for name, domain in config.items():
+        if isinstance(domain, Categorical):
+            space[name] = list(domain.categories)
+        else:
+            space[name] = [type(domain).__name__, domain.lower, domain.upper, getattr(domain.get_sampler(), "q", None)]
+
+    # (サポートベクターマシンは、確率の算出方法により損失値が異なるため算出方法を含む)
+    objective = SVM_PROBABILITY if paramDict["model"] == MODEL.svm.value else None
+    keySource = json.dumps([list(dataKey), paramDict["target"], paramDict["model"], space, objective],
+                           ensure_ascii=False, sort_keys=True, default=str)
+    studyName = hashlib.sha1(keySource.encode("utf-8")).hexdigest()
+
+    # スタディ毎のジャーナルファイルに保存 (複数の最適化からの同時書き込みはファイルロックで排他)
+    os.makedirs(OPTIMIZE_STUDY_DIR, exist_ok=True)
+    storage = optuna.storages.JournalStorage(JournalFileBackend(os.path.join(OPTIMIZE_STUDY_DIR, studyName + ".log")))
+    return studyName, storage
+
+
+# 機能：試行履歴最良設定取得処理
+# 概要：保存済みのスタディの完了した試行数が指定数に達している場合、損失値が最小の試行の設定を返す。
+#      達していない場合はNoneを返し、最適化はスタディの試行履歴を引き継いで追加の試行を行う。
+#      最良スコアの設定と損失値を返す。
+def GetStudyBestConfig(studyName, storage, numSamples):
+    study = optuna.create_study(study_name=studyName, storage=storage, direction="minimize", load_if_exists=True)
+    trials = study.get_trials(deepcopy=False, states=(optuna.trial.TrialState.COMPLETE,))
+    if len(trials) < numSamples:
+        return None
+
+    bestTrial = min(trials, key=lambda trial: trial.value)
+    return dict(bestTrial.params), bestTrial.value
+
+
+# 機能：全組み合わせ評価試行履歴取得処理
+# 概要：全組み合わせ評価の結果を記録するスタディと、各パラメータの分布(探索範囲の候補値)を取得する。
+#      分布はOptunaSearchが探索範囲から生成する分布と同一とし、全組み合わせ評価の無効時にも同一のスタディを引き継げるようにする。
+#      試行履歴を保存しない場合はNoneを返す。
+def GetGridStudy(studyName, storage, config):
+    if storage is None:
+        return None
+
+    study = optuna.create_study(study_name=studyName, storage=storage, direction="minimize", load_if_exists=True)
+    distributions = {name: optuna.distributions.CategoricalDistribution(domain.categories)
+                     for name, domain in config.items()}
+    return study, distributions
+
+
+# 機能：全組み合わせ設定取得処理
+# 概要：探索範囲が全て候補値の選択で、組み合わせ数がOPTIMIZE_GRID_MAX以下の場合、全組み合わせの設定を取得する。
+#      結果に影響しないパラメータ(線形カーネルのgamma)は先頭の候補値に揃え、重複する設定は除く。
+#      最大試行数での打ち切りや最大実行時間での中断が組み合わせの生成順に偏らないよう、固定シードでシャッフルした順に返す。
+#      ニューラルネットワークの場合や、全組み合わせ評価の対象外の場合はNoneを返す。
+def GetGridConfigs(config, model):
+    if (os.getenv("OPTIMIZE_GRID", "True") != "True") or (model == MODEL.nn.value):
+        return None
+    if not all(isinstance(domain, Categorical) for domain in config.values()):
+        return None
+    if math.prod(len(domain.categories) for domain in config.values()) > OPTIMIZE_GRID_MAX:
+        return None
+
+    gridConfigs = []
+    gridKeys = set()
+    for values in itertools.product(*[domain.categories for domain in config.values()]):
+        gridConfig = dict(zip(config.keys(), values))
+        # サポートベクターマシンの線形カーネル (gammaを使用しない)
+        if (model == MODEL.svm.value) and (gridConfig["kernel"] == "linear"):
+            gridConfig["gamma"] = config["gamma"].categories[0]
+
+        gridKey = tuple(gridConfig.values())
+        if gridKey not in gridKeys:
+            gridKeys.add(gridKey)
+            gridConfigs.append(gridConfig)
+
+    order = np.random.default_rng(OPTIMIZE_GRID_SEED).permutation(len(gridConfigs))
+    return [gridConfigs[i] for i in order]
+
+
+# 機能：全組み合わせ最適化処理
+# 概要：全組み合わせの設定を、最適化に割り当てたCPU数のワーカープロセスで並列に評価し、損失値が最小の設定を返す。
+#      試行データ(分割データ、近傍探索結果、カーネル行列の算出元)は全てのワーカーで共有し(読み取り専用)、Rayの試行は生成しない。
+#      k近傍法は1設定の評価が近傍探索結果の切り出しのみで、プロセス間通信の方が重いため、1プロセスで順に評価する。
+#      試行履歴が指定されている場合、記録済みの設定は再評価せずに記録された損失値を使用し、評価した設定は完了した試行として記録する。
+#      ジョブが指定されている場合、設定毎の進捗をジョブに記録し、キャンセルが要求された場合は評価済みの設定から選択する。
+#      最大実行時間を超えた場合や、目標損失値に達した場合も、評価済みの設定から選択する。
+#      (停止条件は評価結果を受け取る毎に確認し、最大実行時間は評価結果の待機にも適用して、評価中の設定はワーカープロセスごと中断する)
+#      最良スコアの設定・損失値および、評価した設定数を返す。
+def OptimizeGrid(gridConfigs, df, paramDict, dataKey, numCpus, job=None, startTime=None, maxSeconds=None, targetLoss=None,
+                 study=None):
+    bestConfig = None
+    bestLoss = None
+    trials = 0
+    
+    # 記録済みの設定の損失値を使用 (損失値が同一の場合は先の設定を優先)
+    recorded = {}
+    if study is not None:
+        for trial in study[0].get_trials(deepcopy=False, states=(optuna.trial.TrialState.COMPLETE,)):
+            recorded[GetGridKey(trial.params)] = trial.value
+    pendingConfigs = []
+    for gridConfig in gridConfigs:
+        loss = recorded.get(GetGridKey(gridConfig))
+        if loss is None:
+            pendingConfigs.append(gridConfig)
+        elif (bestConfig is None) or (loss < bestLoss):
+            bestConfig = gridConfig
+            bestLoss = loss
     
-    # CPU数・GPU数を取得
-    num_cpus = psutil.cpu_count(logical=False)
-    num_gpus = torch.cuda.device_count()
+    # 停止条件の判定
+    def IsStopped():
+        if (job is not None) and job.Cancelled():
+            return True
+        if (maxSeconds is not None) and (time.monotonic() - startTime >= maxSeconds):
+            return True
+        return (targetLoss is not None) and (bestLoss is not None) and (bestLoss <= targetLoss)
     
-    # 最適化実行
-    ray.init(num_cpus=num_cpus, num_gpus=num_gpus, logging_level="INFO", log_to_driver=True, logging_format="text")
+    if (len(pendingConfigs) == 0) or IsStopped():
+        return bestConfig, bestLoss, trials
     
-    analysis = tune.run(
-        learningFunc, config=config, num_samples=50, resources_per_trial={"cpu": num_cpus, "gpu": num_gpus},
-        scheduler=ASHAScheduler(metric="loss", mode="min", max_t=50, grace_period=5, reduction_factor=2),
-        search_alg=OptunaSearch(metric="loss", mode="min"))
+    # 試行データ取得処理
+    trialData = GetTrialData(df, paramDict, dataKey)
+    
+    # ワーカー数および1設定あたりのCPU数 (ワーカー数×1設定あたりのCPU数が割り当てCPU数を超えないようにする)
+    if paramDict["model"] == MODEL.knn.value:
+        numWorkers = 1
+    else:
+        numWorkers = max(min(numCpus, len(pendingConfigs)), 1)
+    configCpus = max(numCpus // numWorkers, 1)
     
-    # 最良スコアの設定を取得
-    best_config = analysis.get_best_config(metric="loss", mode="min")
-    # Rayを終了
-    ray.shutdown()
+    # 評価処理 (評価結果を設定の順に逐次受け取る、大きな配列はメモリマップで共有)
+    if numWorkers == 1:
+        losses = (EvaluateTrdt(gridConfig, trialData, paramDict, configCpus) for gridConfig in pendingConfigs)
+    else:
+        timeout = max(maxSeconds - (time.monotonic() - startTime), 0.0) if maxSeconds is not None else None
+        parallel = joblib.Parallel(n_jobs=numWorkers, return_as="generator", pre_dispatch="n_jobs", timeout=timeout)
+        losses = parallel(joblib.delayed(EvaluateTrdt)(gridConfig, trialData, paramDict, configCpus)
+                          for gridConfig in pendingConfigs)
+    try:
+        for gridConfig, loss in zip(pendingConfigs, losses):
+            if (bestConfig is None) or (loss < bestLoss):
+                bestConfig = gridConfig
+                bestLoss = loss
+            
+            # 評価結果を完了した試行として記録
+            if study is not None:
+                study[0].add_trial(optuna.trial.create_trial(params=gridConfig, distributions=study[1], value=loss))
+            
+            trials += 1
+            if job is not None:
+                job.Progress(len(gridConfigs) - len(pendingConfigs) + trials, len(gridConfigs), "trial")
+            
+            if IsStopped():
+                break
+    except multiprocessing.TimeoutError:
+        # 最大実行時間内に評価結果を受け取れなかった場合は、評価済みの設定から選択
+        pass
+    finally:
+        # 未完了の評価を中断 (中断した評価数の警告は出力しない)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            losses.close()
     
-    # 最良スコアの設定を返す
-    return best_config
+    return bestConfig, bestLoss, trials
+
+
+# 機能：全組み合わせ設定キー取得処理
+# 概要：設定(パラメータ名と値)から、試行履歴の設定と照合するためのキーを取得する。
+def GetGridKey(gridConfig):
+    return json.dumps(gridConfig, sort_keys=True, default=str)
+
+
+# 機能：試行データ取得処理
+# 概要：全試行で共通の前処理済みデータ(分析問題および分割データ)を取得する。
+#      データキーが指定されている場合、分割データは学習実行処理とキャッシュを共有する。
+def GetTrialData(df, paramDict, dataKey=None):
+    target = paramDict["target"]
+    # 分析問題取得処理
+    problem, uniqueNum = GetProblem(df, target)
+
+    # 分割データ取得処理
+    if paramDict["model"] == MODEL.nn.value:
+        split = GetSplit_Nn(df, problem, target, dataKey)
+    else:
+        split = GetSplit_Trdt(df, target, dataKey)
+
+    trialData = dict(split, problem=problem, uniqueNum=uniqueNum)
+    # サポートベクターマシンの場合、カーネル行列の算出元の行列を追加
+    if paramDict["model"] == MODEL.svm.value:
+        trialData.update(GetKernelBase(split))
+    # k近傍法の場合、距離尺度毎の近傍探索結果(探索範囲の最大の近傍数)を追加
+    elif paramDict["model"] == MODEL.knn.value:
+        trialData["neighbors"] = {metric: GetNeighbors(split, target, metric, KNN_MAX_K, dataKey)
+                                  for metric in KNN_METRICS}
+
+    return trialData
+
+
+# 機能：カーネル行列算出元取得処理
+# 概要：サポートベクターマシンの各試行で共有する、カーネル行列の算出元の行列を取得する。
+#      グラム行列(内積)と二乗距離の行列から、全てのカーネル・gammaのカーネル行列を要素毎の演算のみで算出できる。
+#      線形: G  多項式: (γG)^3  シグモイド: tanh(γG)  RBF: exp(-γD)  (G: グラム行列、D: 二乗距離の行列)
+#      メモリ上限(SVM_KERNEL_MB)を超える場合は空の辞書を返す。
+def GetKernelBase(split):
+    xTrain = split["x"][split["train"]].astype(np.float64)
+    xTest = split["x"][split["test"]].astype(np.float64)
+
+    # メモリ使用量 (訓練×訓練、テスト×訓練のグラム行列・二乗距離の行列)
+    size = 2 * (len(xTrain) + len(xTest)) * len(xTrain) * 8
+    if size > SVM_KERNEL_MB * 1024 * 1024:
+        return {}
+
+    # グラム行列
+    gramTrain = xTrain @ xTrain.T
+    gramTest = xTest @ xTrain.T
+    # 二乗距離の行列 (丸め誤差による負の値は0とする)
+    normTrain = np.einsum("ij,ij->i", xTrain, xTrain)
+    normTest = np.einsum("ij,ij->i", xTest, xTest)
+    distTrain = np.maximum(normTrain[:, None] + normTrain[None, :] - 2 * gramTrain, 0)
+    distTest = np.maximum(normTest[:, None] + normTrain[None, :] - 2 * gramTest, 0)
+
+    # gamma="scale"の値 (訓練データから算出。SVC/SVRと同一)
+    xVar = xTrain.var()
+    gammaScale = 1.0 / (xTrain.shape[1] * xVar) if xVar != 0 else 1.0
+
+    return {"gramTrain": gramTrain, "gramTest": gramTest, "distTrain": distTrain, "distTest": distTest,
+            "gammaScale": gammaScale}
+
+
+# 機能：カーネル行列取得処理
+# 概要：カーネル行列の算出元の行列から、指定されたカーネル・gammaの訓練データ・テストデータのカーネル行列を取得する。
+#      多項式・シグモイドのパラメータはSVC/SVRの既定値(degree=3、coef0=0)とする。
+def GetKernelMatrix(trialData, kernel, gamma):
+    if gamma == "scale":
+        gamma = trialData["gammaScale"]
+
+    if kernel == "linear":
+        return trialData["gramTrain"], trialData["gramTest"]
+    if kernel == "poly":
+        return (gamma * trialData["gramTrain"]) ** 3, (gamma * trialData["gramTest"]) ** 3
+    if kernel == "sigmoid":
+        return np.tanh(gamma * trialData["gramTrain"]), np.tanh(gamma * trialData["gramTest"])
+
+    return np.exp(-gamma * trialData["distTrain"]), np.exp(-gamma * trialData["distTest"])
+
+
+# 機能：学習関数取得処理
+# 概要：試行データを渡した学習関数を取得する。
+#      試行データはRayのオブジェクトストアに一度だけ格納し、各試行はコピーせずに参照する。
+#
+# OPTIMIZE_OBJECT_STORE: オブジェクトストアで試行データを共有するか (既定値: True)
+#                        Falseの場合、学習関数に試行データを直接渡す(試行毎に複製される)
+#
+def GetLearningFunc(trialData, paramDict, numCpus):
+    if paramDict["model"] == MODEL.nn.value:
+        func = LearningFunc_Nn
+    else:
+        func = LearningFunc_Trdt
+
+    if os.getenv("OPTIMIZE_OBJECT_STORE", "True") == "True":
+        return tune.with_parameters(func, trialData=trialData, paramDict=paramDict, numCpus=numCpus)
+
+    return lambda config: func(config, trialData, paramDict, numCpus)
+
+
+# 機能：試行リソース取得処理
+# 概要：モデルの種類および最適化に割り当てたリソースに応じて、1試行あたりのリソースと同時実行試行数を取得する。
+#      k近傍法・サポートベクターマシン: 学習は単一コアで行われるため、1試行1CPU
+#      ランダムフォレスト              : 割り当てたCPUを4分割し、1試行の並列数(n_jobs)とする
+#      ニューラルネットワーク          : 1試行1CPU。GPUがある場合、同時実行試行数でGPUを分割
+#
+# OPTIMIZE_MAX_CONCURRENT_TRIALS: 同時実行試行数の上限 (未指定の場合、CPU数から算出した値)
+#
+def GetTrialResources(model, num_cpus, num_gpus):
+    # 1試行あたりのCPU数
+    if model == MODEL.rf.value:
+        cpuPerTrial = max(int(num_cpus // 4), 1)
+    else:
+        cpuPerTrial = 1
+
+    # 同時実行試行数
+    maxConcurrentTrials = max(int(num_cpus // cpuPerTrial), 1)
+    if os.getenv("OPTIMIZE_MAX_CONCURRENT_TRIALS"):
+        maxConcurrentTrials = min(maxConcurrentTrials, int(os.getenv("OPTIMIZE_MAX_CONCURRENT_TRIALS")))
+
+    # 1試行あたりのGPU数
+    if (model == MODEL.nn.value) and (num_gpus > 0):
+        gpuPerTrial = num_gpus / maxConcurrentTrials
+    else:
+        gpuPerTrial = 0
+
+    return {"cpu": cpuPerTrial, "gpu": gpuPerTrial}, maxConcurrentTrials
+
+
+# 機能：ジョブ進捗コールバッククラス
+# 概要：試行の完了毎に、完了した試行数をジョブに記録する。
+class JobTuneCallback(Callback):
+    # コンストラクタ
+    def __init__(self, job, numSamples):
+        self.job = job
+        self.numSamples = numSamples
+        self.completed = 0
+
+    # 試行完了処理
+    def on_trial_complete(self, iteration, trials, trial, **info):
+        self.completed += 1
+        self.job.Progress(self.completed, self.numSamples, "trial")
+
+    # 試行エラー処理
+    def on_trial_error(self, iteration, trials, trial, **info):
+        self.on_trial_complete(iteration, trials, trial, **info)
+
+
+# 機能：ジョブ停止条件クラス
+# 概要：ジョブのキャンセルが要求された場合、全ての試行を停止する。
+class JobStopper(Stopper):
+    # コンストラクタ
+    def __init__(self, job):
+        self.job = job
+
+    # 試行毎の停止判定 (個別の試行は停止しない)
+    def __call__(self, trial_id, result):
+        return False
+
+    # 全試行の停止判定
+    def stop_all(self):
+        return self.job.Cancelled()
+
+
+# 機能：目標損失値停止条件クラス
+# 概要：いずれかの試行の損失値が目標損失値以下になった場合、全ての試行を停止する。
+class TargetLossStopper(Stopper):
+    # コンストラクタ
+    def __init__(self, targetLoss):
+        self.targetLoss = targetLoss
+        self.reached = False
+
+    # 試行毎の停止判定 (個別の試行は停止せず、目標損失値への到達を記録)
+    def __call__(self, trial_id, result):
+        if ("loss" in result) and (result["loss"] <= self.targetLoss):
+            self.reached = True
+        return False
+
+    # 全試行の停止判定
+    def stop_all(self):
+        return self.reached
 
 
 # 機能：ニューラルネットワーク 学習関数
 # 概要：最適化処理向けのニューラルネットワークの学習処理。
-def LearningFunc_Nn(config, df, paramDict):
-    # パラメータ辞書を設定
+#      試行に割り当てたCPU数をPyTorchのスレッド数とし、データローダのワーカは使用しない。
+def LearningFunc_Nn(config, trialData, paramDict, numCpus=1):
+    # スレッド数を設定
+    torch.set_num_threads(numCpus)
+    
+    # パラメータ辞書を設定 (試行間で共有されるため複製して変更)
+    paramDict = dict(paramDict)
     for idx in range(1, 6):
         # 終了層 (選択された層より前にFalse、以降にTrueを設定)
         if idx < config["last"]:
@@ -132,28 +677,81 @@ def LearningFunc_Nn(config, df, paramDict):
     # 学習率
     paramDict["lr"] = config["lr"]
     
-    # 分析問題取得処理
-    problem, uniqueNum = GetProblem(df, paramDict["target"])
+    # 分析問題
+    problem, uniqueNum = trialData["problem"], trialData["uniqueNum"]
     # データローダ取得処理
-    num_features, train_loader, val_loader, _ = GetDataloader(df, problem, paramDict["target"], config["miniBatch"])
+    num_features, train_loader, val_loader, _ = GetDataloaderSplit(trialData, config["miniBatch"], numWorkers=0)
     
     # ニューラルネットワークのモデル定義
     model = Net(num_features, paramDict, problem, uniqueNum)
     # Early Stopping設定
     earlyStopCallback = EarlyStopping(monitor="val_loss", min_delta=0.0, patience=5, verbose=True, mode="min")
+    # エポック毎に検証データの損失値を記録 (スケジューラが途中で試行を打ち切れるようにする)
+    reportCallback = TuneReportCallback()
+    
+    # 失敗した試行を再試行する場合、チェックポイントから学習を再開
+    # (ASHAは試行を打ち切るのみで一時停止しないため、再開はFailureConfigで再試行を設定した場合の失敗後の再試行のみ)
+    checkpoint = ray.train.get_checkpoint()
     
     # 学習実行
-    trainer = Trainer(callbacks=[earlyStopCallback], max_epochs=50)
-    trainer.fit(model, train_loader, val_loader)
-    # 検証データの損失値を記録
-    ray.train.report({"loss": trainer.callback_metrics["val_loss"].item()})
+    trainer = Trainer(callbacks=[earlyStopCallback, reportCallback], max_epochs=50)
+    if checkpoint is None:
+        trainer.fit(model, train_loader, val_loader)
+    else:
+        with checkpoint.as_directory() as checkpointDir:
+            trainer.fit(model, train_loader, val_loader, ckpt_path=os.path.join(checkpointDir, TuneReportCallback.CHECKPOINT_FILE))
+
+
+# 機能：Tune記録コールバッククラス
+# 概要：検証の終了毎に検証データの損失値を記録し、保存する場合は指定エポック毎に学習状態をチェックポイントとして保存する。
+#      チェックポイントは失敗後の再試行でのみ使用され(再試行は既定で無効)、保存のI/Oが試行を遅くするため既定では保存しない。
+#
+# OPTIMIZE_CHECKPOINT       : チェックポイントを保存するか (既定値: False)
+# OPTIMIZE_CHECKPOINT_EPOCHS: チェックポイントを保存するエポック間隔 (既定値: 10)
+#
+class TuneReportCallback(pl.Callback):
+    # チェックポイントのファイル名
+    CHECKPOINT_FILE = "checkpoint.ckpt"
+
+    # コンストラクタ
+    def __init__(self):
+        super().__init__()
+        self.saveCheckpoint = (os.getenv("OPTIMIZE_CHECKPOINT", "False") == "True")
+        self.checkpointEpochs = max(int(os.getenv("OPTIMIZE_CHECKPOINT_EPOCHS", "10")), 1)
+
+    # 検証終了時
+    def on_validation_end(self, trainer, pl_module):
+        # 学習前の動作確認(サニティチェック)は記録しない
+        if trainer.sanity_checking:
+            return
+
+        metrics = {"loss": trainer.callback_metrics["val_loss"].item(), "epoch": trainer.current_epoch}
+        if (not self.saveCheckpoint) or ((trainer.current_epoch + 1) % self.checkpointEpochs != 0):
+            ray.train.report(metrics)
+            return
+
+        # 学習状態を一時ディレクトリに保存し、記録と同時にTuneへ渡す
+        with tempfile.TemporaryDirectory() as checkpointDir:
+            trainer.save_checkpoint(os.path.join(checkpointDir, self.CHECKPOINT_FILE))
+            ray.train.report(metrics, checkpoint=Checkpoint.from_directory(checkpointDir))
 
 
 # 機能：従来モデル 学習関数
-# 概要：最適化処理向けの従来モデルの学習処理。
-def LearningFunc_Trdt(config, df, paramDict):
-    # 分析問題取得処理
-    problem, uniqueNum = GetProblem(df, paramDict["target"])
+# 概要：最適化処理向けの従来モデルの学習処理。評価処理の損失値を記録する。
+def LearningFunc_Trdt(config, trialData, paramDict, numCpus=1):
+    # 評価処理
+    loss = EvaluateTrdt(config, trialData, paramDict, numCpus)
+    # 損失値を記録
+    ray.train.report({"loss": loss})
+
+
+# 機能：従来モデル 評価処理
+# 概要：選択されたパラメータで従来モデルを学習し、テストデータの損失値を返す。
+#      確率を校正しないサポートベクターマシン(SVM_PROBABILITY=decision)の分類問題は、誤分類率(%)を損失値とする。
+#      ランダムフォレストは、試行に割り当てたCPU数を並列数(n_jobs)とする(並列数取得処理を参照)。
+def EvaluateTrdt(config, trialData, paramDict, numCpus=1):
+    # 分析問題
+    problem = trialData["problem"]
     
     # 選択されたパラメータに基づき、モデル定義
     # ランダムフォレスト
@@ -165,6 +763,7 @@ def LearningFunc_Trdt(config, df, paramDict):
                 max_features=config["max_features"],
                 max_depth=config["max_depth"],
                 min_samples_split=config["min_samples_split"],
+                n_jobs=GetNumJobs(numCpus),
                 random_state=0)
             
         # 分類問題
@@ -174,42 +773,47 @@ def LearningFunc_Trdt(config, df, paramDict):
                 max_features=config["max_features"],
                 max_depth=config["max_depth"],
                 min_samples_split=config["min_samples_split"],
+                n_jobs=GetNumJobs(numCpus),
                 random_state=0)
         
     # サポートベクターマシン
     elif paramDict["model"] == MODEL.svm.value:
+        # カーネル行列を共有している場合、算出済みのカーネル行列を使用
+        kernel = "precomputed" if "gramTrain" in trialData else config["kernel"]
+        
         if problem == PROBLEM.regression:
             model = SVR(
-                kernel=config["kernel"],
+                kernel=kernel,
                 C=config["C"],
-                gamma=config["gamma"],
-                random_state=0)
+                gamma=config["gamma"])
             
         else:
             model = SVC(
-                kernel=config["kernel"],
+                kernel=kernel,
                 C=config["C"],
                 gamma=config["gamma"],
-                probability=True,
+                probability=(SVM_PROBABILITY == "platt"),
                 random_state=0)
         
-    # k近傍法
+    # k近傍法 (共有の近傍探索結果から予測するため、モデルは定義しない)
     else:
-        if problem == PROBLEM.regression:
-            model = KNeighborsRegressor(
-                n_neighbors=config["n_neighbors"],
-                weights=config["weights"],
-                algorithm=config["algorithm"],
-                metric=config["metric"])
-            
-        else:
-            model = KNeighborsClassifier(
-                n_neighbors=config["n_neighbors"],
-                weights=config["weights"],
-                algorithm=config["algorithm"],
-                metric=config["metric"])
+        model = None
     
     # 予測処理
-    metrics = Predict(df, paramDict["target"], model, problem, uniqueNum)
-    # 損失値を記録
-    ray.train.report({"loss": metrics[0][0]})
+    # カーネル行列を共有しているサポートベクターマシンの場合、カーネル行列で学習・予測
+    if (paramDict["model"] == MODEL.svm.value) and ("gramTrain" in trialData):
+        kernelTrain, kernelTest = GetKernelMatrix(trialData, config["kernel"], config["gamma"])
+        y = trialData["t"]
+        metrics = FitPredict(model, kernelTrain, y[trialData["train"]], kernelTest, y[trialData["test"]], problem)
+    # k近傍法の場合、共有の近傍探索結果から予測 (モデルの学習・近傍探索は行わない)
+    elif paramDict["model"] == MODEL.knn.value:
+        metrics = PredictNeighbors(trialData, trialData["neighbors"][config["metric"]], config["n_neighbors"],
+                                   config["weights"], problem)
+    else:
+        metrics = PredictSplit(trialData, model, problem)
+    
+    # 確率を校正しないサポートベクターマシンの分類問題の場合、誤分類率(%)を返す
+    if (paramDict["model"] == MODEL.svm.value) and (problem != PROBLEM.regression) and (SVM_PROBABILITY == "decision"):
+        return 100 - metrics[0][1]
+    
+    return metrics[0][0]
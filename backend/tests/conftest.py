@@ -0,0 +1,8 @@
+###############################################################################
+# 機能：テスト共通設定
+# 概要：バックエンドのモジュールをテストから読み込めるよう、検索パスに追加する。
+###############################################################################
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
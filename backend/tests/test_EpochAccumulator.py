@@ -0,0 +1,60 @@
+###############################################################################
+# 機能：エポック集計クラスのテスト
+# 概要：混同行列から算出した各指標が、torchmetricsの算出結果と一致することを確認する。
+###############################################################################
+import pytest
+
+torch = pytest.importorskip("torch")
+torchmetrics = pytest.importorskip("torchmetrics")
+pytest.importorskip("pytorch_lightning")
+
+from Learning import EpochAccumulator
+
+
+# 予測値(クラス番号)を、該当クラスが最大となる出力値に変換
+def ToOutput(yPred, classNum):
+    return torch.nn.functional.one_hot(yPred, classNum).float()
+
+
+# エポック集計クラスの指標を、ミニバッチに分割して算出
+def Accumulate(yPred, yTest, classNum, miniBatch=4):
+    accumulator = EpochAccumulator(classNum)
+    for start in range(0, len(yTest), miniBatch):
+        end = start + miniBatch
+        accumulator.Update(torch.tensor(0.0), ToOutput(yPred[start:end], classNum), yTest[start:end])
+    return accumulator.Compute()
+
+
+# torchmetricsの指標を算出
+def Reference(yPred, yTest, classNum):
+    if classNum == 2:
+        args = {"task": "binary"}
+    else:
+        args = {"task": "multiclass", "num_classes": classNum}
+    average = {} if classNum == 2 else {"average": "macro"}
+    return {
+        "acc": torchmetrics.Accuracy(**args)(yPred, yTest).item(),
+        "prec": torchmetrics.Precision(**args, **average)(yPred, yTest).item(),
+        "rec": torchmetrics.Recall(**args, **average)(yPred, yTest).item(),
+        "f1": torchmetrics.F1Score(**args, **average)(yPred, yTest).item()}
+
+
+@pytest.mark.parametrize("classNum", [2, 3, 5])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_metrics_match_torchmetrics(classNum, seed):
+    generator = torch.Generator().manual_seed(seed)
+    yTest = torch.randint(0, classNum, (50,), generator=generator)
+    yPred = torch.randint(0, classNum, (50,), generator=generator)
+
+    result = Accumulate(yPred, yTest, classNum)
+    for name, value in Reference(yPred, yTest, classNum).items():
+        assert result[name] == pytest.approx(value, abs=1e-6), name
+
+
+def test_multiclass_accuracy_is_micro():
+    yPred = torch.tensor([0, 0, 0, 0, 1, 2])
+    yTest = torch.tensor([0, 0, 0, 0, 0, 1])
+
+    result = Accumulate(yPred, yTest, 3)
+    assert result["acc"] == pytest.approx(4 / 6)
+    assert result["acc"] == pytest.approx(Reference(yPred, yTest, 3)["acc"])
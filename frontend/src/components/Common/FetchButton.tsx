@@ -34,8 +34,7 @@ export default function FetchButton(props: {
         // インポート
         Import: {
             buttonText: "インポート",
-            ResProcFunc: (resData) => props.fetchImport && props.fetchImport.SetInputDataVal
-                                      && props.fetchImport.SetInputDataVal(resData.arg),
+            ResProcFunc: (resData) => ImportResProc(resData),
         },
         // 前処理
         Preproc: {
@@ -59,6 +58,16 @@ export default function FetchButton(props: {
     // キーに対応するコンフィグを設定
     const { buttonText, GetArgFunc, ResProcFunc } = configMap[props.req] || [];
 
+    // インポート レスポンス受信処理 (先頭ページの行データおよび全体の行数を設定)
+    const ImportResProc = (resData: any) => {
+        if (!props.fetchImport) {
+            return;
+        }
+        props.fetchImport.SetInputPage({ page: 0, pageSize: props.fetchImport.pageSize });
+        props.fetchImport.SetInputTotal(resData.total);
+        props.fetchImport.SetInputDataVal(resData.arg);
+    };
+
     // 前処理 レスポンス受信処理
     const PreprocResProc = (resData: any) => {
         // 前処理データ列名を設定
@@ -218,11 +227,17 @@ export default function FetchButton(props: {
         type FetchSendData = {
             req: string; selectData: string;
             arg?: (string | number | boolean)[];
+            offset?: number; limit?: number;
         }
         const fetchSendData: FetchSendData = { req: props.req, selectData };
         if (GetArgFunc) {
             fetchSendData.arg = GetArgFunc();
         }
+        // インポートの場合、先頭ページのみ取得
+        if ((props.req === FETCH_REQ.Import) && (props.fetchImport)) {
+            fetchSendData.offset = 0;
+            fetchSendData.limit = props.fetchImport.pageSize;
+        }
 
         // フェッチ待ち状態を設定
         SetWaitFetch(props.req);
@@ -230,14 +245,21 @@ export default function FetchButton(props: {
         SetFetchError("");
 
         try {
-            // フェッチ処理
-            const response = await fetch(process.env.REACT_APP_WEBAPI_URL as string, {
-                method: "POST",
-                headers: { "Content-Type": "application/json" },
-                body: JSON.stringify(fetchSendData),
-            });
-            // レスポンス受信
-            const resData = await response.json();
+            let resData;
+            // ニューラルネットワークの学習の場合、ジョブとして実行し、エポック毎の損失値を逐次受信
+            if ((props.req === FETCH_REQ.Learning) && (model === MODEL.nn)) {
+                resData = await FetchLearningJob(fetchSendData);
+
+            } else {
+                // フェッチ処理
+                const response = await fetch(process.env.REACT_APP_WEBAPI_URL as string, {
+                    method: "POST",
+                    headers: { "Content-Type": "application/json" },
+                    body: JSON.stringify(fetchSendData),
+                });
+                // レスポンス受信
+                resData = await response.json();
+            }
 
             // レスポンスを正しく受信できた場合、レスポンス受信処理を実行
             if (resData.res === props.req) {
@@ -260,6 +282,56 @@ export default function FetchButton(props: {
         }
     };
 
+    // 学習ジョブ フェッチ処理
+    // 学習をジョブとして投入し、終了までエポック毎の検証データ損失値を受信してグラフに反映する
+    const FetchLearningJob = async (fetchSendData: object) => {
+        const baseUrl = (process.env.REACT_APP_WEBAPI_URL as string).replace(/\/api$/, "");
+
+        // ジョブ投入
+        const submitResponse = await fetch(`${baseUrl}/job/submit`, {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify(fetchSendData),
+        });
+        const submitData = await submitResponse.json();
+        if (submitData.res !== "JobSubmit") {
+            return submitData;
+        }
+        const { jobId } = submitData.arg;
+
+        // ジョブ終了まで、エポック毎の損失値を受信
+        await new Promise<void>((resolve) => {
+            const valLosses: number[] = [];
+            const eventSource = new EventSource(`${baseUrl}/job/events/${jobId}`);
+            eventSource.addEventListener("epoch", (event) => {
+                valLosses.push(Math.round(JSON.parse((event as MessageEvent).data).loss * 100) / 100);
+                props.fetchLearning?.SetValLosses([...valLosses]);
+            });
+            eventSource.addEventListener("end", () => {
+                eventSource.close();
+                resolve();
+            });
+            eventSource.onerror = () => {
+                eventSource.close();
+                resolve();
+            };
+        });
+
+        // ジョブ結果を取得 (切断された場合は終了まで待つ)
+        for (;;) {
+            const resultResponse = await fetch(`${baseUrl}/job/result`, {
+                method: "POST",
+                headers: { "Content-Type": "application/json" },
+                body: JSON.stringify({ jobId }),
+            });
+            const resultData = await resultResponse.json();
+            if ((resultData.res !== "JobStatus") || (["error", "cancelled"].includes(resultData.arg.status))) {
+                return resultData;
+            }
+            await new Promise((resolve) => setTimeout(resolve, 1000));
+        }
+    };
+
     // 無効化条件
     const disabled = (waitFetch !== "")
                      || ((process.env.NODE_ENV === "production") && (props.fetchLearning) && (model === MODEL.nn));
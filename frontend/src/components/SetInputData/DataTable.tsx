@@ -1,18 +1,26 @@
 /*****************************************************************************
  * 機能：データグリッド
  * 概要：データをデータグリッド形式で表示する。
+ *       ページング情報が指定されている場合、表示中のページの行データのみを保持する(サーバ側ページング)。
  *****************************************************************************/
 import React from "react";
-import { DataGrid, GridColDef } from "@mui/x-data-grid";
+import { DataGrid, GridColDef, GridPaginationModel } from "@mui/x-data-grid";
+import { ServerPaging } from "../index";
 
 export default function DataTable(props: {
   gridCol: GridColDef[];
   data: (string | number)[][];
+  serverPaging?: ServerPaging;
 }) {
+  // 表示中のページの先頭行の位置 (サーバ側ページングの場合)
+  const offset = props.serverPaging
+    ? props.serverPaging.paginationModel.page * props.serverPaging.paginationModel.pageSize
+    : 0;
+
   // 行データ設定
   const rows = props.data.map((dataRow: (string | number)[], index: number) => {
     // 「id」にインデックス値を設定
-    const row: { [key: string]: string | number } = { id: index };
+    const row: { [key: string]: string | number } = { id: offset + index };
     // 「id」を除く各列のデータを設定
     props.gridCol.slice(1).forEach((col, colIndex) => {
       row[col.field] = dataRow[colIndex];
@@ -21,6 +29,26 @@ export default function DataTable(props: {
     return row;
   });
 
+  // サーバ側ページング
+  if (props.serverPaging) {
+    const { rowCount, paginationModel, loading, FetchPage } = props.serverPaging;
+    return (
+      <div className="datagrid">
+        <DataGrid
+          rows={rows}
+          columns={props.gridCol}
+          paginationMode="server"
+          rowCount={rowCount}
+          paginationModel={paginationModel}
+          onPaginationModelChange={(model: GridPaginationModel) => FetchPage(model)}
+          loading={loading}
+          pageSizeOptions={[5, 10, 20, 50, 100]}
+          checkboxSelection
+        />
+      </div>
+    );
+  }
+
   return (
     <div className="datagrid">
       <DataGrid
@@ -6,7 +6,7 @@ import React, { useState, useEffect, useContext } from "react";
 import "../../style.css";
 import Tooltip from "@mui/material/Tooltip";
 import CircularProgress from "@mui/material/CircularProgress";
-import { GridColDef } from "@mui/x-data-grid";
+import { GridColDef, GridPaginationModel } from "@mui/x-data-grid";
 import { CommonContext, CommonTButton, FetchButton, DataTable, SelectTarget,
          CONFIG_KEY, INPUT_DATA, FETCH_REQ, tooltipML } from "../index";
 
@@ -15,7 +15,7 @@ export default function SetInputData(props: {
   SetPreprocData: (value: (string | number)[][]) => void;
 }) {
   // useStateを取得
-  const { selectData, waitFetch, fetchError } = useContext(CommonContext);
+  const { selectData, waitFetch, fetchError, SetFetchError } = useContext(CommonContext);
 
   // 仮選択入力データ
   const [preSelectData, SetPreSelectData] = useState(INPUT_DATA.titanic);
@@ -148,8 +148,48 @@ export default function SetInputData(props: {
   // 入力データ列情報
   const [inputGridCol, SetInputGridCol] = useState(titanicGridCol);
 
-  // 入力データ
+  // 入力データ (インポート時に取得した先頭ページの行データ)
   const [inputData, SetInputDataVal] = useState<(string | number)[][]>([]);
+  // 入力データ 表示中のページの行データ
+  const [inputPageData, SetInputPageData] = useState<(string | number)[][]>([]);
+  // 入力データ 全体の行数
+  const [inputTotal, SetInputTotal] = useState(0);
+  // 入力データ 表示中のページ
+  const [inputPage, SetInputPage] = useState<GridPaginationModel>({ page: 0, pageSize: 5 });
+  // 入力データ ページ取得中フラグ
+  const [pageLoading, SetPageLoading] = useState(false);
+  useEffect(() => {
+    // 入力データが変化した場合、表示中のページの行データを設定
+    SetInputPageData(inputData);
+  }, [inputData]);
+
+  // 入力データ ページ取得処理 (表示するページの行データのみをサーバから取得)
+  const FetchInputPage = async (model: GridPaginationModel) => {
+    SetInputPage(model);
+    SetPageLoading(true);
+    try {
+      const response = await fetch(process.env.REACT_APP_WEBAPI_URL as string, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({
+          req: FETCH_REQ.Import, selectData, offset: model.page * model.pageSize, limit: model.pageSize,
+        }),
+      });
+      const resData = await response.json();
+
+      if (resData.res === FETCH_REQ.Import) {
+        SetInputTotal(resData.total);
+        SetInputPageData(resData.arg);
+      } else {
+        SetFetchError(FETCH_REQ.Import);
+      }
+    } catch (error) {
+      SetFetchError(FETCH_REQ.Import);
+    } finally {
+      SetPageLoading(false);
+    }
+  };
+
   useEffect(() => {
     // 入力データが変化した場合、入力データ列名および仮選択ターゲットを初期化
     if (selectData === INPUT_DATA.titanic) {
@@ -267,7 +307,8 @@ export default function SetInputData(props: {
         {/* 入力データ仮選択 */}
         <CommonTButton configKey={CONFIG_KEY.inputData} preSelectDataUS={{ preSelectData, SetPreSelectData }} />
         {/* インポートボタン */}
-        <FetchButton req={FETCH_REQ.Import} fetchImport={{ preSelectData, SetInputDataVal }} />
+        <FetchButton req={FETCH_REQ.Import}
+                     fetchImport={{ preSelectData, SetInputDataVal, pageSize: inputPage.pageSize, SetInputPage, SetInputTotal }} />
         {/* インポート中プログレス */}
         {(waitFetch === FETCH_REQ.Import) && (<CircularProgress />)}
         {/* インポートエラーメッセージ */}
@@ -279,7 +320,11 @@ export default function SetInputData(props: {
       {/* 入力データが設定されている場合に表示 */}
       {(inputData.length > 0) && (<>
         {/* 入力データ データグリッド */}
-        <div className="margin-cont"><DataTable gridCol={inputGridCol} data={inputData} /></div>
+        <div className="margin-cont">
+          <DataTable gridCol={inputGridCol} data={inputPageData} serverPaging={{
+            rowCount: inputTotal, paginationModel: inputPage, loading: pageLoading, FetchPage: FetchInputPage,
+          }} />
+        </div>
 
         <div id="Preproc" className="separator-line" />
 
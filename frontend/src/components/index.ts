@@ -3,6 +3,7 @@
  * 概要：各コンポーネントおよび定義のエクスポートを行う。
  *****************************************************************************/
 import { createContext } from "react";
+import { GridPaginationModel } from "@mui/x-data-grid";
 
 // 共通コンポーネント
 export { default as CommonCheckBox } from "./Common/CommonCheckBox";
@@ -48,7 +49,7 @@ export enum ALGORITHM { auto = "auto", ball_tree = "ball_tree", kd_tree = "kd_tr
 export enum METRIC { euclidean = "euclidean", manhattan = "manhattan", chebyshev = "chebyshev" }
 
 // フェッチリクエスト
-export const FETCH_REQ = { Import: "Import", Preproc: "Preproc", Optimize: "Optimize", Learning: "Learning" };
+export const FETCH_REQ = { Import: "Import", Count: "Count", Preproc: "Preproc", Optimize: "Optimize", Learning: "Learning", Predict: "Predict" };
 
 // スライダーインプット 最大・最小・デフォルト値
 export type SInputValue = { minValue: number; maxValue: number; defValue: number; };
@@ -117,6 +118,16 @@ export const ModelContext = createContext({
 export type FetchImportProps = {
     preSelectData: INPUT_DATA;
     SetInputDataVal: (value: (string | number)[][]) => void;
+    pageSize: number; // 取得する先頭ページの行数
+    SetInputPage: (value: GridPaginationModel) => void;
+    SetInputTotal: (value: number) => void;
+}
+// データグリッド サーバ側ページング情報
+export type ServerPaging = {
+    rowCount: number; // 全体の行数
+    paginationModel: GridPaginationModel; // 表示中のページ
+    loading: boolean; // ページ取得中フラグ
+    FetchPage: (model: GridPaginationModel) => void; // ページ取得関数
 }
 // 前処理フェッチ 引数
 export type FetchPreprocProps = {